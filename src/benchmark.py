@@ -0,0 +1,274 @@
+import argparse
+import glob
+import os
+import random
+import time
+from typing import (Callable, List)
+from perl_translator.lexer import lex
+from parsers.common_parser import reduceEmbeddedExprs
+from util.execution_manager import ExecutionManager
+from util.context import (Context, cleanXml, compileQuestionTemplates)
+from util.variant_profiler import getRuntimeNamespace
+from util.question_server import (loadQuestionServer, genPlData)
+from util.question_html import buildQuestionHtml
+from main import walkXmlTree
+import xml.etree.ElementTree as ET
+
+
+# micro benchmarks for the converter hot paths
+# usage (from the repo root): python src/benchmark.py <benchmark> [options]
+
+
+# returns the best wall time of fn() over a few repetitions, in seconds
+def timeIt(fn: Callable, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(name: str, sizeBytes: int, elapsed: float) -> None:
+    kb = sizeBytes / 1024
+    print("{:<12} {:>8.0f} KB   {:>10.1f} KB/s".format(name, kb, kb / elapsed))
+
+
+
+# ------------------------ perl lexer ------------------------
+
+# a lon-capa style perl script of roughly the given size made of assignments
+def genPerlScript(sizeBytes: int) -> str:
+    rand = random.Random(0)
+    lines = []
+    size = 0
+    i = 0
+    while size < sizeBytes:
+        line = rand.choice([
+            '$x{0} = &random(1, 10, 0.5);',
+            '$y{0} = $x{0} * 2.5e-3 + ($x{0} ** 2) / 7;',
+            '@arr{0} = (1, 2, 3, $x{0});',
+            '$s{0} = "value of x is $x{0}" . \'!\';',
+            '$z{0} = &roundto($y{0}, 2); # keep two decimals',
+        ]).format(i)
+        lines.append(line)
+        size += len(line) + 1
+        i += 1
+    return "\n".join(lines) + "\n"
+
+
+def benchLexer(args: argparse.Namespace) -> None:
+    for size in args.sizes:
+        script = genPerlScript(size)
+        report("lex", len(script), timeIt(lambda: lex(script)))
+
+
+
+# ------------------------ embedded expression reducer ------------------------
+
+# stands in for Context, binding embedded expressions against a fixed script
+class BenchContext():
+
+    def __init__(self, script: str) -> None:
+        self._executionManager = ExecutionManager(ExecutionManager.VAR_DISCOVERY_STATIC)
+        self._executionManager.setScript(ExecutionManager.SCOPE_DEFAULT, script)
+        self._problemData = dict()
+
+    def getVisibleVariablesNames(self, scope: str) -> set[str]:
+        return self._executionManager.getLocalVarNames(scope)
+
+    def addReference(self, scope: str, expr: str) -> str:
+        return self._executionManager.addReference(scope, expr)
+
+    def setScript(self, scope: str, script: str) -> None:
+        self._executionManager.setScript(scope, script)
+
+
+# prompt html of roughly the given size with many $var and $array[$idx] references
+def genPromptHtml(sizeBytes: int) -> str:
+    rand = random.Random(0)
+    parts = []
+    size = 0
+    while size < sizeBytes:
+        part = rand.choice([
+            "<p>The mass of the sample is $mass g and its volume is $volume mL.</p>",
+            "<td>$values[$i]</td><td>$values[2]</td>",
+            "<b>Compute</b> the density to $digits significant figures &amp; report it.",
+            "<span>costs $$5 at 25 &deg;C</span>",
+        ])
+        parts.append(part)
+        size += len(part)
+    return "\n".join(parts)
+
+
+def benchReducer(args: argparse.Namespace) -> None:
+    script = "scalar_mass=1\nscalar_volume=2\nscalar_digits=3\nscalar_i=0\nvector_values=[1,2,3]\n"
+    for size in args.sizes:
+        text = genPromptHtml(size)
+        elapsed = timeIt(lambda: reduceEmbeddedExprs(text, BenchContext(script), ExecutionManager.SCOPE_DEFAULT, inText=True))
+        report("reduce", len(text), elapsed)
+
+
+
+# ------------------------ problem xml sanitizer ------------------------
+
+def benchCleanXml(args: argparse.Namespace) -> None:
+    problemPaths = sorted(glob.glob(args.problems), key=os.path.getsize, reverse=True)[:args.largest]
+    for problemPath in problemPaths:
+        with open(problemPath, "r", encoding="utf-8") as f:
+            xml = "<root>" + f.read() + "</root>"
+        cleaned = cleanXml(xml)
+        elapsed = timeIt(lambda: cleanXml(xml))
+        parse = timeIt(lambda: ET.fromstring(cleaned))
+        report(os.path.basename(problemPath)[:12], len(xml), elapsed)
+        print("{:<12} ET.fromstring {:.2f} ms, sanitizer {:.2f} ms".format("", parse * 1000, elapsed * 1000))
+
+
+
+# ------------------------ problem tree walker ------------------------
+
+# a problem whose text is made of many small inline elements, split over a few parts
+def genInlineProblem(elements: int) -> ET.Element:
+    rand = random.Random(0)
+    root = ET.Element("root")
+    problem = ET.SubElement(root, "problem")
+    script = ET.SubElement(problem, "script", type="loncapa/perl")
+    script.text = "$mass = 1; $volume = 2; $i = 0; @values = (1, 2, 3);"
+    parts = [ET.SubElement(problem, "part", id=str(i)) for i in range(4)]
+    for i in range(elements):
+        parent = rand.choice(parts)
+        elem = ET.SubElement(parent, rand.choice(["b", "i", "sub", "sup", "span"]))
+        elem.text = rand.choice(["$mass", "$values[$i]", "H", "2", "x"])
+        elem.tail = rand.choice([" and ", " g of ", "\n", " = $volume mL "])
+    return root
+
+
+def benchWalker(args: argparse.Namespace) -> None:
+    for size in args.sizes:
+        root = genInlineProblem(size)
+        sizeBytes = len(ET.tostring(root))
+        report("walk", sizeBytes, timeIt(lambda: walkXmlTree(root, BenchContext(""))))
+
+
+
+# ------------------------ question.html emission ------------------------
+
+# problem data of the given number of questions, cycling through the response types
+def genProblemData(questions: int) -> dict:
+    flags = ["isStringResponse", "isRadioButtonResponse", "isOptionResponse", "isNumericalResponse", "isRankResponse"]
+    data = {"questions": [], "tail": "<p>That is all &amp; thanks.</p>"}
+    for i in range(questions):
+        data["questions"].append({
+            "prompt": "<p>Compute the density of sample {{{params.generatedVars.x.value-%d}}} at 25 &deg;C.</p>" % i,
+            "answerId": "ans-%d" % i,
+            flags[i % len(flags)]: True,
+            "inputSize": 10, "placeholder": "", "label": "", "isBlank": "false", "sort": "ascend",
+            "hint": {"precedingText": "", "prompt": "use <b>rho = m / V</b>", "files": [{"name": "table.png", "isImage": True}]},
+        })
+    return data
+
+
+def benchQuestionHtml(args: argparse.Namespace) -> None:
+    problemData = None
+
+    def build():
+        return ET.tostring(buildQuestionHtml(problemData), encoding="unicode", short_empty_elements=False)
+
+    for questions in args.sizes:
+        problemData = genProblemData(questions)
+        report("html", len(build()), timeIt(build))
+
+
+
+# ------------------------ generated question runtime ------------------------
+
+def benchVariants(args: argparse.Namespace) -> None:
+    for questionPath in sorted(glob.glob(args.questions)):
+        if not os.path.isfile(questionPath + "/variables.py"):
+            continue
+        server = loadQuestionServer(questionPath)
+        variableGenerators = server.generate.__globals__["_variableGenerators"]
+
+        def generateVariants():
+            for _ in range(args.iterations):
+                server.generate(genPlData(questionPath))
+
+        optimized = timeIt(generateVariants)
+        # without a precompiled generator generate() falls back to exec/eval of the scripts
+        mtime, problemHash, _ = variableGenerators[questionPath]
+        variableGenerators[questionPath] = (mtime, problemHash, None)
+        baseline = timeIt(generateVariants)
+        variableGenerators.pop(questionPath)
+        print("{:<40} baseline {:>9.0f} variants/s   optimized {:>9.0f} variants/s   speedup {:>6.1f}x".format(
+            os.path.basename(questionPath), args.iterations / baseline, args.iterations / optimized, baseline / optimized))
+
+
+
+# an option response question whose foils all render generated variables, as data.json holds it
+def genOptionQuestion(foils: int) -> tuple[dict, dict]:
+    question = {
+        "isOptionResponse": True,
+        "scope": "scope_default",
+        "randomizeDisplayOrder": False,
+        "maxDisplayed": -1,
+        "options": ["True", "False", "Cannot tell"],
+        "foils": [],
+    }
+    variables = dict()
+    for i in range(foils):
+        question["foils"].append({
+            "foilName": "f%d" % i,
+            "foilPrompt": "Sample {{value-%d}} of {{value-%d}} g dissolves in {{value-%d}} mL of water at 25 &deg;C" % (3 * i, 3 * i + 1, 3 * i + 2),
+            "answerValue": "{{value-%d}}" % (3 * i) if i % 2 == 0 else "False",
+            "isConceptGroup": False,
+        })
+        variables["value-%d" % (3 * i)] = "True" if i % 4 == 0 else "False"
+        variables["value-%d" % (3 * i + 1)] = 1.5 * i
+        variables["value-%d" % (3 * i + 2)] = 100 + i
+    return question, variables
+
+
+def benchTemplates(args: argparse.Namespace) -> None:
+    genVariant = getRuntimeNamespace(Context._genRuntimeCode())["genVariant"]
+    for foils in args.foils:
+        question, variables = genOptionQuestion(foils)
+        compiled = compileQuestionTemplates(question)
+        random.seed(0)
+        expected = genVariant({"questions": {"ans-1": question}}, variables)
+        random.seed(0)
+        if genVariant({"questions": {"ans-1": compiled}}, variables) != expected:
+            raise Exception("tokenized templates render a different variant")
+
+        def renderVariants(problemData: dict):
+            return lambda: [genVariant(problemData, variables) for _ in range(args.iterations)]
+
+        baseline = timeIt(renderVariants({"questions": {"ans-1": question}}))
+        optimized = timeIt(renderVariants({"questions": {"ans-1": compiled}}))
+        print("{:>5} foils   baseline {:>9.0f} variants/s   optimized {:>9.0f} variants/s   speedup {:>6.1f}x".format(
+            foils, args.iterations / baseline, args.iterations / optimized, baseline / optimized))
+
+
+
+benchmarks = {
+    "lexer": benchLexer,
+    "reducer": benchReducer,
+    "variants": benchVariants,
+    "cleanxml": benchCleanXml,
+    "walker": benchWalker,
+    "questionhtml": benchQuestionHtml,
+    "templates": benchTemplates,
+}
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="benchmark converter hot paths and the generated question runtime")
+    argParser.add_argument("benchmark", choices=list(benchmarks.keys()))
+    argParser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000, 100_000], help="input sizes in bytes, inline elements for the walker or questions for questionhtml")
+    argParser.add_argument("--questions", default="out/questions/*", help="glob of generated question dirs")
+    argParser.add_argument("--iterations", type=int, default=1000, help="generate() calls per question, variants per foil count for templates")
+    argParser.add_argument("--foils", type=int, nargs="+", default=[50, 100, 200], help="foils of the option response question rendered by templates")
+    argParser.add_argument("--problems", default="sample_questions/*/*.problem", help="glob of lon-capa problem files")
+    argParser.add_argument("--largest", type=int, default=10, help="number of largest problem files to benchmark")
+    args = argParser.parse_args()
+    benchmarks[args.benchmark](args)
@@ -1,5 +1,5 @@
 import xml.etree.ElementTree as ET
-from util.context import Context
+from util.context import Context, RESOURCE_STORE_DIR, VARIANT_PROFILE_DIR
 from parsers.option_response_parser import parseOptionResponse
 from parsers.numerical_response_parser import parseNumericalResponse
 from parsers.rank_response_parser import parseRankResponse
@@ -9,15 +9,29 @@ from parsers.reaction_response_parser import parseReactionResponse
 from parsers.common_parser import *
 import json
 import os
+import argparse
+import multiprocessing
+from typing import (List, Tuple)
 from pathlib import Path
 from perl_translator.lexer import *
 import shutil
 from util.exceptions import *
 from util.execution_manager import ExecutionManager
+from util.build_manifest import BuildManifest
+from util.rewrite_pipeline import RewritePipeline
+from util.resource_store import ResourceStore
+from util.output_sink import (getOutputSink, configureOutputSink)
+from util.variant_profiler import (profileVariants, checkVariantProfile)
 from util.logger import logger
 
 # _source_folder = "chem104"
 _source_folder = "sample_questions"
+_output_dir = "out/questions"
+_variant_profile_report = "out/variant_profile.json"
+
+# options that do not change the generated questions, which are not rebuilt when they change:
+# profileSamples only changes the variant profiles and streamXml how problem files are read
+_unhashed_options = ["profileSamples", "streamXml"]
 
 # parser for elements outside of question elements
 commonTargets = {
@@ -36,84 +50,96 @@ problemTargets = {
     "formularesponse": None,
 }
 
+# in-place rewrites of lon-capa elements into html, applied in one pass before walking the tree
+rewritePipeline = RewritePipeline()
+rewritePipeline.register("img", parseImage)
+rewritePipeline.register("chem", parseChemEquation)
+rewritePipeline.register("m", refactorLatexExprs)
+rewritePipeline.register("a", parseLink)
+
 # generate target prairielearn files from lon-capa definitions
 def genTarget(ctx: Context) -> None:
     root = ctx.xmlRoot
-    parseImage(root)
-    parseChemEquation(root)
-    refactorLatexExprs(root)
+    timings = rewritePipeline.apply(root, ctx)
+    logger.debug("rewrite timings for %s: %s" % (ctx.problemName, ", ".join("%s %.3f ms" % (name, t * 1000) for name, t in timings.items())))
     walkXmlTree(root, ctx)
     ctx.moveStaticResources()
     ctx.genTargetResource()
+    # let the writes of the question run while the next one is converted
+    getOutputSink().endQuestion()
+
+
+# events pushed on the walkXmlTree stack
+_EVENT_ENTER = 0        # payload: element to visit
+_EVENT_LEAVE = 1        # payload: markup closing an element, followed by its tail
+_EVENT_POP_SCOPE = 2    # payload: unused, the part being left
+
+_not_html_tags = {"script", "part", "problem", "startouttext", "endouttext", "starttext", "endtext", "allow", "parameter", "root"}
 
 
 # dfs the xml tree and search for target tags
+# the markup preceding the next question is accumulated as a list of fragments, joined only when consumed
 def walkXmlTree(root: ET.Element, ctx: Context) -> None:
 
-    notHTML = ["script", "part", "problem", "startouttext", "endouttext", "starttext", "endtext", "allow", "parameter", "root"]
-    precedingMarkup = "" if root.text is None else root.text
+    fragments = [] if root.text is None else [root.text]
 
-    stack = [root]
+    stack = [(_EVENT_ENTER, root)]
     scopes = [ExecutionManager.SCOPE_DEFAULT]
     ctx.setScript(ExecutionManager.SCOPE_DEFAULT, "")
 
     while len(stack) > 0:
-        elem = stack.pop()
+        event, payload = stack.pop()
 
-        if type(elem) == str:
-            if elem == "pop_scope":
-                precedingMarkup = reduceEmbeddedExprs(precedingMarkup, ctx, scopes[-1], inText=True)
-                scopes.pop()
-            else:
-                precedingMarkup += elem 
+        if event == _EVENT_LEAVE:
+            fragments.append(payload)
+            continue
+
+        if event == _EVENT_POP_SCOPE:
+            fragments = [reduceEmbeddedExprs("".join(fragments), ctx, scopes[-1], inText=True)]
+            scopes.pop()
             continue
 
+        elem = payload
         tag = elem.tag 
 
         if tag == "script":
             parseScript(elem, ctx, scopes[-1])
         
         elif tag == "hintgroup":
-            parseProblemHint(elem, ctx, scopes[-1], precedingMarkup)
-            precedingMarkup = "" if elem.tail is None else elem.tail
+            parseProblemHint(elem, ctx, scopes[-1], "".join(fragments))
+            fragments = [] if elem.tail is None else [elem.tail]
 
         elif tag in problemTargets:
-            parseProblem(elem, ctx, precedingMarkup, scopes[-1])
-            precedingMarkup = "" if elem.tail is None else elem.tail
+            parseProblem(elem, ctx, "".join(fragments), scopes[-1])
+            fragments = [] if elem.tail is None else [elem.tail]
 
         else:
+            # some elems are not html
+            closing = ""
+            if not tag in _not_html_tags:
+                attrs = " ".join('{}="{}"'.format(k, v) for k, v in elem.attrib.items()) if len(elem.attrib) > 0 else ""
+                fragments.append("<{} {}>".format(tag, attrs))
+                closing = "</{}>".format(tag)
+
+            if elem.text is not None:
+                fragments.append(elem.text)
+                
+            if elem.tail is not None: 
+                closing += elem.tail 
+            stack.append((_EVENT_LEAVE, closing))
 
-            # try explore children
-            children = [child for child in elem]
-            
             if tag == "part":
                 scopeId = "scope_" + elem.get("id")
                 if scopeId in scopes:
                     raise Exception("Duplicate part id in problem")
                 scopes.append(scopeId)
                 ctx.setScript(scopeId, "")
-                children.append("pop_scope")
-
-            children.reverse()
+                stack.append((_EVENT_POP_SCOPE, None))
 
-            tail = ""
-            # some elems are not html
-            if not tag in notHTML:
-                attrs = " ".join('{}="{}"'.format(k, v) for k, v in elem.attrib.items())
-                precedingMarkup += "<{} {}>".format(tag, attrs)
-                tail = "</{}>".format(tag)
-
-            if elem.text is not None:
-                precedingMarkup += elem.text
-                
-            if elem.tail is not None: 
-                tail = tail + elem.tail 
-            
-            children = [tail] + children # hacky, adds in succeeding text
-            stack += children
+            # explore children
+            stack.extend((_EVENT_ENTER, child) for child in reversed(elem))
     
-    if precedingMarkup is not None:
-        ctx._problemData["tail"] =  reduceEmbeddedExprs(precedingMarkup, ctx, scopes[-1], inText=True)
+    ctx._problemData["tail"] = reduceEmbeddedExprs("".join(fragments), ctx, scopes[-1], inText=True)
 
 
 def parseProblem(elem: ET.Element, ctx: Context, prompt: str, scope: str) -> None:
@@ -136,23 +162,203 @@ def parseProblem(elem: ET.Element, ctx: Context, prompt: str, scope: str) -> Non
         
 def cleanFolder(folder):
     for filename in os.listdir(folder):
-        file_path = os.path.join(folder, filename)
+        removePath(os.path.join(folder, filename))
+
+
+def removePath(file_path):
+    try:
+        if os.path.isfile(file_path):
+            os.unlink(file_path)    # remove file
+        elif os.path.isdir(file_path):
+            shutil.rmtree(file_path)    # remove folder
+    except Exception as e:
+        logger.warning('Failed to clean folder %s with error %s' % (file_path, e))
+
+
+
+# problems sharing the same name across question dirs are only converted once
+def getProblemKey(problemName: str) -> str:
+    return "".join(problemName.split("-")[1:])
+
+
+# group question dirs by problem key, preserving the sorted dir order
+def groupQuestionDirs(fileDirs: List[str]) -> dict[str, List[str]]:
+    groups = dict()
+    for path in fileDirs:
+        problemFile = Context.findProblemFile(path)
+        if problemFile is None:
+            groups[path] = [path]   # let the converter report the missing problem file
+            continue
+        key = getProblemKey(Context.getProblemName(path, problemFile))
+        groups.setdefault(key, []).append(path)
+    return groups
+
+
+# convert the first convertible question dir of a group
+# returns (converted dir, problem id), or None if every dir in the group failed
+# runs inside worker processes when --jobs > 1, each worker builds its own Context
+# options are passed on to Context as keyword arguments
+def convertQuestionGroup(paths: List[str], options: dict|None = None) -> Tuple[str, str]|None:
+    options = {} if options is None else options
+    for path in paths:
+        logger.info("start processing " + path)
         try:
-            if os.path.isfile(file_path):
-                os.unlink(file_path)    # remove file
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)    # remove folder
+            ctx = Context(path, **options)
+            genTarget(ctx)
+            logger.info("completed processing " + path)
+            return (path, ctx.problemName)
+
         except Exception as e:
-            logger.warning('Failed to clean folder %s with error %s' % (file_path, e))
+            if e in tolerableExceptions:
+                logger.warning(e)
+            else:
+                logger.error(e, exc_info=True)
+    return None
+
+
+# a SystemExit raised by a conversion would silently kill the pool worker and hang the pool,
+# surface it to the driver instead so the run aborts like a serial one does
+# the writes of the question are flushed before its result is handed back
+def convertQuestionGroupInWorker(paths: List[str], options: dict|None = None) -> Tuple[Tuple[str, str]|None, bool]:
+    try:
+        results, writeFailed = flushQuestionOutputs([paths], [convertQuestionGroup(paths, options)], options)
+        return results[0], writeFailed[0]
+    except SystemExit as e:
+        raise RuntimeError("conversion aborted while processing %s" % ", ".join(paths)) from e
+
+
+# wait for the pending writes of converted groups. a group whose files could not be written is reported
+# and converted again from the dirs after the one that failed, as a failing write does in a synchronous run
+# returns the results and whether the writes of each group failed, such groups must not be recorded
+# as converted so that the next build retries them
+def flushQuestionOutputs(groupPaths: List[List[str]], results: List[Tuple[str, str]|None],
+                         options: dict|None = None) -> Tuple[List[Tuple[str, str]|None], List[bool]]:
+    results = list(results)
+    writeFailed = [False] * len(results)
+    errors = getOutputSink().flush()
+    while len(errors) > 0:
+        for problemId, e in errors.items():
+            logger.error("failed writing output of %s" % problemId, exc_info=e)
+        retried = []
+        for i, res in enumerate(results):
+            if res is not None and res[1] in errors:
+                paths = groupPaths[i]
+                results[i] = convertQuestionGroup(paths[paths.index(res[0]) + 1:], options)
+                writeFailed[i] = True
+                retried.append(i)
+        errors = getOutputSink().flush()
+        for i in retried:
+            # a later dir of the group was converted and written
+            if results[i] is not None and results[i][1] not in errors:
+                writeFailed[i] = False
+    return results, writeFailed
+
+
+# groups whose writes failed are forgotten rather than recorded as not convertible,
+# so that the next build converts them again even if their sources did not change
+def recordConvertedGroups(manifest: BuildManifest, keys: List[str], sources: dict[str, dict[str, str]],
+                          results: List[Tuple[str, str]|None], writeFailed: List[bool]) -> None:
+    for key, res, failed in zip(keys, results, writeFailed):
+        if failed:
+            manifest.forget(key)
+        else:
+            manifest.record(key, sources[key], res)
+
+
+# write the shared runtime package, or remove the one a previous build with --shared-runtime left,
+# since no question imports it anymore
+def updateSharedRuntime(sharedRuntime: bool) -> None:
+    if sharedRuntime:
+        Context.genSharedRuntime()
+    elif os.path.isdir(Context.sharedRuntimeDir()):
+        logger.info("removing stale shared runtime " + Context.sharedRuntimeDir())
+        removePath(Context.sharedRuntimeDir())
+
+
+# profile the questions that were up to date but have no profile of the requested number of samples,
+# from the variables.py and data.json they were converted to
+def profileConvertedQuestions(problemIDs: List[str], samples: int) -> None:
+    runtimeCode = None
+    for problemId in problemIDs:
+        questionDir = _output_dir + "/" + problemId
+        profilePath = Context.variantProfilePath(problemId)
+        if os.path.isfile(profilePath):
+            with open(profilePath, "r") as f:
+                if json.loads(f.read()).get("requestedSamples") == samples:
+                    continue
+        if not os.path.isfile(questionDir + "/variables.py"):
+            logger.warning("Not profiling variants of %s, it has no variables.py" % problemId)
+            continue
+        with open(questionDir + "/variables.py", "r") as f:
+            generatorCode = f.read()
+        with open(questionDir + "/data.json", "r") as f:
+            data = json.loads(f.read())
+        runtimeCode = Context._genRuntimeCode() if runtimeCode is None else runtimeCode
+        profile = profileVariants(runtimeCode, generatorCode, data, samples)
+        checkVariantProfile(problemId, profile)
+        Path(VARIANT_PROFILE_DIR).mkdir(parents=True, exist_ok=True)
+        with open(profilePath, "w") as f:
+            f.write(json.dumps(profile, indent=4))
+
+
+# collect the variant profiles of converted questions, least accepted first
+def writeVariantProfileReport(problemIDs: List[str]) -> None:
+    profiles = dict()
+    for problemId in problemIDs:
+        profilePath = Context.variantProfilePath(problemId)
+        if os.path.isfile(profilePath):
+            with open(profilePath, "r") as f:
+                profiles[problemId] = json.loads(f.read())
+        else:
+            logger.warning("%s is left out of the variant profile report, it was not profiled" % problemId)
+    ordered = sorted(profiles.items(), key=lambda item: (item[1]["acceptanceRate"] is not None, item[1]["acceptanceRate"] or 0))
+    with open(_variant_profile_report, "w") as f:
+        f.write(json.dumps(dict(ordered), indent=4))
+    logger.info("variant profile report written to " + _variant_profile_report)
 
 
 
 if __name__ == "__main__":
-    problemNames = set()
-    problemIDs = []
+    argParser = argparse.ArgumentParser(description="convert lon-capa problems to prairielearn questions")
+    argParser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes used for conversion")
+    argParser.add_argument("--clean", action="store_true", help="discard previous output and rebuild every question")
+    argParser.add_argument("--var-discovery", choices=[ExecutionManager.VAR_DISCOVERY_EXEC, ExecutionManager.VAR_DISCOVERY_STATIC],
+                           default=ExecutionManager.VAR_DISCOVERY_EXEC,
+                           help="find the variables visible to embedded expressions by executing scripts, or statically from their assignments. "
+                                "static runs no problem script during conversion and disables --profile-variants")
+    argParser.add_argument("--shared-runtime", action="store_true",
+                           help="emit the question runtime once under serverFilesCourse and import it from every question")
+    argParser.add_argument("--profile-variants", type=int, default=0, metavar="SAMPLES",
+                           help="sample each question's variants offline and report how often they are rejected")
+    argParser.add_argument("--pretty-html", action="store_true", help="indent the generated question.html files")
+    argParser.add_argument("--write-threads", type=int, default=0,
+                           help="write generated files on this many background threads while the next problem is converted")
+    argParser.add_argument("--all-resources", action="store_true",
+                           help="copy every file of a problem's res folder, not only the ones the problem references")
+    argParser.add_argument("--variant-attempts", type=int, default=0, metavar="N",
+                           help="candidate variables generate() draws before it fails, 0 for the runtime default of 1000")
+    argParser.add_argument("--variant-batch", type=int, default=0, metavar="N",
+                           help="candidate variables generate() draws and evaluates per round, 0 for the runtime default of 1")
+    argParser.add_argument("--stream-xml", action="store_true",
+                           help="read problem files larger than 1 MB in chunks through a pull parser instead of loading them whole")
+    args = argParser.parse_args()
+    options = {
+        "varDiscovery": args.var_discovery,
+        "sharedRuntime": args.shared_runtime,
+        "profileSamples": args.profile_variants,
+        "prettyHtml": args.pretty_html,
+        "allResources": args.all_resources,
+        "streamXml": args.stream_xml,
+        "variantAttempts": args.variant_attempts,
+        "variantBatch": args.variant_batch,
+    }
 
-    Path("out/questions").mkdir(parents=True, exist_ok=True)
-    cleanFolder("out/questions")
+    Path(_output_dir).mkdir(parents=True, exist_ok=True)
+    manifest = BuildManifest({key: value for key, value in options.items() if key not in _unhashed_options})
+    if args.clean or manifest.isEmpty():
+        manifest.reset()
+        cleanFolder(_output_dir)
+        removePath(VARIANT_PROFILE_DIR)
 
     curPath = str(Path(__file__).parent.resolve())  # get the absolute path of the parent directory of current file
     fileDirs = []
@@ -164,33 +370,54 @@ if __name__ == "__main__":
             continue
         fileDirs.append(path)
     fileDirs = sorted(fileDirs)
-    for path in fileDirs:
-        logger.info("start processing " + path)
-        try:
-            ctx = Context(path)
-            problemName = "".join(ctx.problemName.split("-")[1:])
-            if problemName not in problemNames:
-                
-                genTarget(ctx)
-                problemNames.add(problemName)
-                problemIDs.append(ctx.problemName)
-            
-            logger.info("completed processing " + path)
+    # position of each dir in the sorted order, results of the pool are put back in it
+    dirOrder = {path: i for i, path in enumerate(fileDirs)}
+    groups = groupQuestionDirs(fileDirs)
+
+    # only re-convert groups whose sources changed since the last build
+    manifest.prune(set(groups.keys()))
+    sources = {key: BuildManifest.hashSources(paths) for key, paths in groups.items()}
+    pending = [key for key in groups if not manifest.isUpToDate(key, sources[key], _output_dir)]
+    logger.info("%d of %d question groups changed since last build" % (len(pending), len(groups)))
+    for key in pending:
+        if (previous := manifest.getConverted(key)) is not None:
+            removePath(_output_dir + "/" + previous[1])
+            removePath(Context.variantProfilePath(previous[1]))
+
+    if args.jobs > 1:
+        with multiprocessing.Pool(args.jobs, initializer=configureOutputSink, initargs=(args.write_threads,)) as pool:
+            flushed = pool.starmap(convertQuestionGroupInWorker, [(groups[key], options) for key in pending], chunksize=1)
+        results, writeFailed = [res for res, _ in flushed], [failed for _, failed in flushed]
+    else:
+        configureOutputSink(args.write_threads)
+        results = [convertQuestionGroup(groups[key], options) for key in pending]
+        results, writeFailed = flushQuestionOutputs([groups[key] for key in pending], results, options)
 
-        except Exception as e:
-            if e in tolerableExceptions:
-                logger.warning(e)
-            else:
-                logger.error(e, exc_info=True)
+    recordConvertedGroups(manifest, pending, sources, results, writeFailed)
+    manifest.save()
 
-            
-        
+    updateSharedRuntime(args.shared_runtime)
 
-       
+    # keep the order in which a serial run over the sorted dirs would have produced them
+    converted = [res for key in groups if (res := manifest.getConverted(key)) is not None]
+    converted = sorted(converted, key=lambda res: dirOrder[res[0]])
+    problemIDs = [problemId for _, problemId in converted]
 
+    # prune outputs no converted group produced, e.g. of groups whose sources disappeared
+    for outputName in set(os.listdir(_output_dir)) - set(problemIDs):
+        logger.info("removing stale output " + outputName)
+        removePath(_output_dir + "/" + outputName)
+    if os.path.isdir(VARIANT_PROFILE_DIR):
+        for profileName in set(os.listdir(VARIANT_PROFILE_DIR)) - set(problemId + ".json" for problemId in problemIDs):
+            removePath(VARIANT_PROFILE_DIR + "/" + profileName)
 
+    if (removed := ResourceStore(RESOURCE_STORE_DIR).prune(set(problemIDs))) > 0:
+        logger.info("removed %d unused files from the resource store" % removed)
+
+    if args.profile_variants > 0 and args.var_discovery == ExecutionManager.VAR_DISCOVERY_EXEC:
+        profileConvertedQuestions(problemIDs, args.profile_variants)
+        writeVariantProfileReport(problemIDs)
 
-    
     # generate course metdata data 
     problemIDs = sorted(problemIDs, key=lambda x: int(x.split("-")[0]))
     
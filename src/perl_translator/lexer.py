@@ -188,73 +188,74 @@ for k, v in DEF.items():
     DEF[k] = re.compile(v, flags=re.MULTILINE|re.DOTALL)
 
 
-def parseString(instream: str):
+# all rules but block comments combined into one pattern, one optional lookahead group per rule,
+# so a single match at a cursor offset reports what every rule would match there.
+# leading '^' anchors are dropped since they never match at a pos= offset mid-line
+_LEXER_RULES = [type for type in DEF if type != COMMENT_BLOCK]
+_MASTER = re.compile(
+    "".join("(?=({}))?".format(re.sub("(^|\\|)\\^", "\\1", DEF[type].pattern)) for type in _LEXER_RULES),
+    flags=re.MULTILINE|re.DOTALL
+)
+_BLOCK_COMMENT_END = "=cut"
+
+
+def parseString(instream: str, start: int = 0):
     
-    delimiter = instream[0]
+    delimiter = instream[start]
     if not delimiter in ['"', "'"]:
         raise Exception("Invalid string delimiter")
     
-    i = 1
+    i = start + 1
     while i < len(instream):
         chr = instream[i]
         if chr == "\\":
             i += 2 
         elif chr == delimiter:
             # deal with trailing double quote to avoid messing up the triple quote we apply 
-            string = instream[1:i]
+            string = instream[start+1:i]
             if string.endswith('"'):
                 string = string[:-1] + '\\"'
-            return (string, i+1)
+            return (string, i+1-start)
         else:
             i += 1
     raise Exception ("Unclosed string")
 
 
 
+# single pass over the script, every rule is matched in place at the cursor offset
+# and the longest match wins, ties going to the rule defined first in DEF
 def lex(perlScript: str) -> List[Tuple[int, str]]:
     tokens = []
     cursor = 0
+    length = len(perlScript)
+    # a block comment runs greedily to the last '=cut', find it once instead of rescanning at every '='
+    blockCommentEnd = perlScript.rfind(_BLOCK_COMMENT_END)
 
-    while cursor < len(perlScript):
+    while cursor < length:
 
         #parse string separately
         if perlScript[cursor] in ["'", '"']:
-            string, length = parseString(perlScript[cursor:])
-            cursor += length
+            string, consumed = parseString(perlScript, cursor)
+            cursor += consumed
             tokens.append((STRING, string))
             continue
 
+        values = _MASTER.match(perlScript, cursor).groups("")
+        lengths = list(map(len, values))
+        longest = max(lengths)
+        lexemeType = _LEXER_RULES[lengths.index(longest)] if longest > 0 else None
 
+        if perlScript[cursor] == "=" and blockCommentEnd > cursor:
+            commentLength = blockCommentEnd + len(_BLOCK_COMMENT_END) - cursor
+            if commentLength > longest:
+                longest = commentLength
+                lexemeType = COMMENT_BLOCK
 
-        lexemeType = None
-        value = None
-        for type, regex in DEF.items():
-            
-            if (matched := regex.match(perlScript[cursor:])) == None:
-                continue
-            v = matched.group(0)
-            if len(v) == 0:
-                raise Exception(symbolName[type], "matches empty string")
-
-            #try match the longest string
-            if value is None or len(v) > len(value):
-                value = v 
-                lexemeType = type
-
-               
-        if lexemeType is None or value is None:
+        if lexemeType is None:
             raise Exception("Lexer failed. No rules matched at: " + perlScript[cursor:])
-        
-        cursor += len(value)
 
-        
         if lexemeType != BLANK:
-            tokens.append((lexemeType, value))
-            
+            tokens.append((lexemeType, perlScript[cursor:cursor+longest]))
+        cursor += longest
         
     return tokens
-
-        
-
-
-
@@ -0,0 +1,206 @@
+import argparse
+import glob
+import json
+import math
+import os
+import random
+import signal
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from util.question_server import (loadQuestionServer, genPlData)
+
+
+# pre-generates variants of converted questions the way prairielearn would, through the
+# generate() and parse() of their server.py, to load test them before an exam
+# usage (from the repo root): python src/pregenerate.py [--variants N] [--processes P] [options]
+
+
+# calls traced for the memory of generate(), tracing slows them down too much to time every call
+_memory_samples = 20
+# distinct exception messages kept per question
+_max_exception_messages = 5
+
+
+class VariantTimeout(Exception):
+    pass
+
+
+# raise VariantTimeout in the block after the given seconds, where the platform supports SIGALRM
+@contextmanager
+def timeLimit(seconds: float):
+    if seconds <= 0 or not hasattr(signal, "SIGALRM"):
+        yield
+        return
+
+    def expire(signum, frame):
+        raise VariantTimeout("no variant after %.1f s" % seconds)
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def percentile(sortedValues: list[float], p: float) -> float|None:
+    if len(sortedValues) == 0:
+        return None
+    return sortedValues[min(len(sortedValues) - 1, math.ceil(p / 100 * len(sortedValues)) - 1)]
+
+
+# answers prairielearn would receive from a student who got every graded input right
+def genCorrectAnswers(params: dict) -> dict:
+    return {questionId: str(variant["answerValue"]) for questionId, variant in params.get("questions", {}).items()
+            if "answerValue" in variant}
+
+
+# run generate() and optionally parse() of one question, returns its report
+def pregenerateQuestion(questionPath: str, variants: int, timeout: float, parse: bool, seed: int|None) -> dict:
+    if seed is not None:
+        random.seed(seed)
+    report = {
+        "question": os.path.basename(questionPath),
+        "variants": 0,
+        "exceptions": 0,
+        "timeouts": 0,
+        "exceptionMessages": dict(),
+    }
+
+    def recordException(stage: str, e: Exception) -> None:
+        report["timeouts" if isinstance(e, VariantTimeout) else "exceptions"] += 1
+        message = "%s: %s: %s" % (stage, type(e).__name__, e)
+        if message in report["exceptionMessages"] or len(report["exceptionMessages"]) < _max_exception_messages:
+            report["exceptionMessages"][message] = report["exceptionMessages"].get(message, 0) + 1
+
+    try:
+        server = loadQuestionServer(questionPath)
+    except Exception as e:
+        recordException("import", e)
+        return report
+    # rejection sampling statistics generate() keeps by question path
+    variantStats = server.generate.__globals__.get("variantStats")
+    stats = variantStats[questionPath] if variantStats is not None else None
+
+    latencies = []
+    parseLatencies = []
+    retries = []
+    paramsSizes = []
+    for _ in range(variants):
+        plData = genPlData(questionPath)
+        attempts = stats["attempts"] if stats is not None else 0
+        start = time.perf_counter()
+        try:
+            with timeLimit(timeout):
+                server.generate(plData)
+        except Exception as e:
+            recordException("generate", e)
+            continue
+        latencies.append(time.perf_counter() - start)
+        if stats is not None:
+            retries.append(stats["attempts"] - attempts - 1)
+        paramsSizes.append(len(json.dumps(plData["params"])))
+        report["variants"] += 1
+
+        if parse:
+            plData["submitted_answers"] = genCorrectAnswers(plData["params"])
+            start = time.perf_counter()
+            try:
+                with timeLimit(timeout):
+                    server.parse(plData)
+            except Exception as e:
+                recordException("parse", e)
+                continue
+            parseLatencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    parseLatencies.sort()
+    report["p50Ms"] = percentile(latencies, 50) * 1000 if len(latencies) > 0 else None
+    report["p99Ms"] = percentile(latencies, 99) * 1000 if len(latencies) > 0 else None
+    report["maxMs"] = latencies[-1] * 1000 if len(latencies) > 0 else None
+    if parse:
+        report["parseP50Ms"] = percentile(parseLatencies, 50) * 1000 if len(parseLatencies) > 0 else None
+        report["parseP99Ms"] = percentile(parseLatencies, 99) * 1000 if len(parseLatencies) > 0 else None
+    report["retries"] = sum(retries) if stats is not None else None
+    report["maxRetries"] = max(retries, default=0) if stats is not None else None
+    report["maxParamsBytes"] = max(paramsSizes, default=0)
+    report["peakMemoryKB"] = measurePeakMemory(server, questionPath, timeout) / 1024 if report["variants"] > 0 else None
+    return report
+
+
+# peak memory allocated by a generate() call, over a few traced calls
+def measurePeakMemory(server, questionPath: str, timeout: float) -> int:
+    peak = 0
+    tracemalloc.start()
+    try:
+        for _ in range(_memory_samples):
+            plData = genPlData(questionPath)
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            try:
+                with timeLimit(timeout):
+                    server.generate(plData)
+            except Exception:
+                continue
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def formatMs(value: float|None) -> str:
+    return "-" if value is None else "%.2f" % value
+
+
+def printReports(reports: list[dict]) -> None:
+    print("{:<40} {:>8} {:>9} {:>9} {:>9} {:>8} {:>6} {:>6} {:>9} {:>10}".format(
+        "question", "variants", "p50 ms", "p99 ms", "max ms", "retries", "errors", "hangs", "params B", "peak KB"))
+    for report in reports:
+        print("{:<40} {:>8} {:>9} {:>9} {:>9} {:>8} {:>6} {:>6} {:>9} {:>10}".format(
+            report["question"][:40], report["variants"], formatMs(report.get("p50Ms")), formatMs(report.get("p99Ms")),
+            formatMs(report.get("maxMs")), "-" if report.get("retries") is None else report["retries"],
+            report["exceptions"], report["timeouts"], report.get("maxParamsBytes", "-"),
+            "-" if report.get("peakMemoryKB") is None else "%.1f" % report["peakMemoryKB"]))
+        for message, count in report["exceptionMessages"].items():
+            print("    %dx %s" % (count, message))
+
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="pre-generate variants of converted questions and report how generate() performs")
+    argParser.add_argument("--questions", default="out/questions/*", help="glob of generated question dirs")
+    argParser.add_argument("--variants", type=int, default=1000, help="generate() calls per question")
+    argParser.add_argument("--processes", type=int, default=0, help="questions pre-generated in parallel by a process pool, 0 to run them in this process")
+    argParser.add_argument("--timeout", type=float, default=10, help="seconds a generate() or parse() call may take before it counts as hung, 0 for no limit")
+    argParser.add_argument("--parse", action="store_true", help="also parse() each variant with its correct answers")
+    argParser.add_argument("--seed", type=int, default=None, help="seed the random generator of each question for reproducible runs")
+    argParser.add_argument("--max-p99-ms", type=float, default=None, help="fail if the p99 latency of some question exceeds it")
+    argParser.add_argument("--report", default=None, help="also write the reports as json to this file")
+    args = argParser.parse_args()
+
+    questionPaths = sorted(path for path in glob.glob(args.questions) if os.path.isfile(path + "/server.py"))
+    if len(questionPaths) == 0:
+        print("no generated questions match " + args.questions)
+        sys.exit(1)
+
+    tasks = [(path, args.variants, args.timeout, args.parse, args.seed) for path in questionPaths]
+    if args.processes > 0:
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            reports = list(executor.map(pregenerateQuestion, *zip(*tasks)))
+    else:
+        reports = [pregenerateQuestion(*task) for task in tasks]
+
+    printReports(reports)
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(reports, f, indent=4)
+
+    failed = [report["question"] for report in reports if report["exceptions"] > 0 or report["timeouts"] > 0
+              or (args.max_p99_ms is not None and report.get("p99Ms") is not None and report["p99Ms"] > args.max_p99_ms)]
+    if len(failed) > 0:
+        print("%d of %d questions failed: %s" % (len(failed), len(reports), ", ".join(failed)))
+        sys.exit(1)
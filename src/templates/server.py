@@ -1,7 +1,8 @@
+import hashlib
 import json
+import os
 from random import sample, shuffle
 from typing import List, Tuple, Any
-import copy
 import re
 from collections import defaultdict
 
@@ -9,19 +10,28 @@ from collections import defaultdict
 # ------------------ prairielearn interfaces start ------------------
 def generate(plData: dict) -> None:
     
-    problemData = loadProblemData(plData)
-
-    
-    while True:
-        variables = genVariables(problemData.get("script", []), problemData.get("embeddedExprs", {}))
-        problemVariant = genVariant(problemData, variables, maxRetry=3)
-        # retry problem variable generation if some does not fit specified constraints 
-        # such as number of significant digits
-        if problemVariant is not None:
-            break
-
+    questionPath = plData["options"]["question_path"]
+    problemData, problemHash = loadProblemFile(questionPath)
+    variableGenerator = loadVariableGenerator(questionPath, problemHash)
+
+    def drawVariables() -> dict:
+        if variableGenerator is not None:
+            return variableGenerator()
+        return genVariables(problemData.get("script", []), problemData.get("embeddedExprs", {}))
+
+    # retry problem variable generation if some does not fit specified constraints 
+    # such as number of significant digits
+    sampling = problemData.get("sampling", {})
+    problemVariant, variables = sampleVariant(problemData, drawVariables, questionPath,
+                                              sampling.get("maxAttempts", VARIANT_MAX_ATTEMPTS),
+                                              sampling.get("abortRejections", VARIANT_ABORT_REJECTIONS),
+                                              sampling.get("batchSize", VARIANT_BATCH_SIZE))
+
+    # params are stored with every variant, keep only what question.html renders,
+    # parse() rehydrates the question definitions from data.json by its hash
+    plData["params"]["problemHash"] = problemHash
     plData["params"]["questions"] = problemVariant
-    plData["params"]["generatedVars"] = variables
+    plData["params"]["generatedVars"] = compactVariables(variables, problemData.get("renderedExprs"))
 
 
 def parse(plData: dict) -> None:
@@ -63,8 +73,7 @@ def ParseReaction(answer:str):
     return reactants,products
 
 def parseReactionResponse(question: dict, questionId, plData: dict) -> None:
-    variables = plData["params"]["generatedVars"].get(question.get("scope"), {})
-    answerValue = str(evaluateEmbeddedExprs(question["answerValue"], variables))
+    answerValue = getAnswerValue(question, questionId, plData)
 
     if (value := plData["submitted_answers"].get(questionId)) is None:
         plData["format_errors"][questionId] = "Empty input."
@@ -75,10 +84,18 @@ def parseReactionResponse(question: dict, questionId, plData: dict) -> None:
 
     plData["submitted_answers"][questionId] = answerValue if isCorrect else value
 
+# the answer evaluated when the variant was generated, variants stored before params
+# were compacted only have the variables to evaluate it with
+def getAnswerValue(question: dict, questionId, plData: dict) -> str:
+    variant = plData["params"]["questions"].get(questionId, {})
+    if "answerValue" in variant:
+        return str(variant["answerValue"])
+    variables = plData["params"]["generatedVars"].get(question.get("scope"), {})
+    return str(evaluateEmbeddedExprs(question["answerValue"], variables))
+
 # check correctness of string input according to specified match type
 def parseStringResponse(question: dict, questionId, plData: dict) -> None:
-    variables = plData["params"]["generatedVars"].get(question.get("scope"), {})
-    answerValue = str(evaluateEmbeddedExprs(question["answerValue"], variables))
+    answerValue = getAnswerValue(question, questionId, plData)
 
     if (value := plData["submitted_answers"].get(questionId)) is None:
         plData["format_errors"][questionId] = "Empty input."
@@ -114,10 +131,64 @@ def parseNumericalResponse(question: dict, questionId,  plData: dict) -> None:
 
 
 
-def genVariant(problemData: dict, variables: dict, maxRetry: int = 10) -> dict:
+# ------------------ variant sampling ------------------
+# rejection sampling: every attempt draws fresh variables, since a variant rejected
+# for its variables (e.g. a sigRange constraint) would be rejected again with the same ones
+# data.json may set the budget of a question under "sampling", these are the defaults
+VARIANT_MAX_ATTEMPTS = 1000
+# straight rejections after which a question the process never saw accept gives up, so that a
+# question whose acceptance rate is too low fails fast instead of using the whole budget on every call
+VARIANT_ABORT_REJECTIONS = 100
+# candidate variable sets drawn and evaluated per round, sampling returns after the round
+# holding the first accepted one. larger batches only feed the statistics more candidates
+VARIANT_BATCH_SIZE = 1
+
+# acceptance statistics by question path, over the lifetime of the process
+variantStats = defaultdict(lambda: {"attempts": 0, "accepted": 0, "rejectedBy": defaultdict(int)})
+
+
+class VariantGenerationError(Exception):
+    pass
+
+
+# returns (variant, variables) for the first candidate variables every question accepts
+def sampleVariant(problemData: dict, drawVariables, questionPath: str, maxAttempts: int = VARIANT_MAX_ATTEMPTS,
+                  abortRejections: int = VARIANT_ABORT_REJECTIONS, batchSize: int = VARIANT_BATCH_SIZE) -> Tuple[dict, dict]:
+    stats = variantStats[questionPath]
+    rejectedBy = defaultdict(int)   # question id -> rejections during this call
+    attempts = 0
+
+    while attempts < maxAttempts:
+        sampled = None
+        for _ in range(min(batchSize, maxAttempts - attempts)):
+            variables = drawVariables()
+            rejecting = []
+            variant = genVariant(problemData, variables, rejecting)
+            attempts += 1
+            stats["attempts"] += 1
+            if variant is None:
+                rejectedBy[rejecting[0]] += 1
+                stats["rejectedBy"][rejecting[0]] += 1
+                continue
+            stats["accepted"] += 1
+            if sampled is None:
+                sampled = (variant, variables)
+        if sampled is not None:
+            return sampled
+        if stats["accepted"] == 0 and attempts >= abortRejections:
+            break
+
+    rejections = ", ".join("{}: {}".format(questionId, count) for questionId, count in
+                           sorted(rejectedBy.items(), key=lambda item: -item[1]))
+    raise VariantGenerationError(
+        "unable to generate a variant for {} after {} attempts, {} accepted by the process in {} attempts, rejections by question: {}".format(
+            questionPath, attempts, stats["accepted"], stats["attempts"], rejections))
 
-    if maxRetry <= 0:
-        return None
+
+# returns None if some question rejects the variables, recording its id in rejectedBy
+# variants are built from scratch with only the fields question.html renders,
+# the problem data is shared between calls and never modified
+def genVariant(problemData: dict, variables: dict, rejectedBy: list|None = None) -> dict|None:
     
     questions = problemData.get("questions", {})
 
@@ -145,9 +216,11 @@ def genVariant(problemData: dict, variables: dict, maxRetry: int = 10) -> dict:
         else:
             raise Exception("Unsupported question type")
 
-        # generated variable is illegal, retry
+        # generated variable is illegal, let the caller draw new ones
         if variant is None:
-            return genVariant(problemData, variables, maxRetry-1)
+            if rejectedBy is not None:
+                rejectedBy.append(questionId)
+            return None
         
 
     
@@ -156,14 +229,14 @@ def genVariant(problemData: dict, variables: dict, maxRetry: int = 10) -> dict:
     return variants
 
 def genStringResponseVariant(question: dict, variables: dict) -> dict:
-    res = copy.deepcopy(question)
-    res["answerValue"] = evaluateEmbeddedExprs(res["answerValue"], variables)
-    return res
+    return {
+        "answerValue": evaluateEmbeddedExprs(question["answerValue"], variables)
+    }
 
 def genReactionResponseVariant(question: dict, variables: dict) -> dict:
-    res = copy.deepcopy(question)
-    res["answerValue"] = evaluateEmbeddedExprs(res["answerValue"], variables)
-    return res
+    return {
+        "answerValue": evaluateEmbeddedExprs(question["answerValue"], variables)
+    }
 
 def genRadioButtonResponseVariant(question: dict, variables: dict = {}) -> dict:
     maxDisplayNum = question["maxDisplayed"]
@@ -316,9 +389,8 @@ def genRankResponseVariant(question: dict, variables) -> dict:
     output = []
     for foil in foils:
         output.append({
-            "foilName": foil["foilName"],
             "foilPrompt": str(evaluateEmbeddedExprs(foil["foilPrompt"], variables)),
-            "rank": str(evaluateEmbeddedExprs(str(foil["rank"]), variables)),
+            "rank": evaluateEmbeddedExprs(foil["rank"], variables),
         })
 
 
@@ -379,12 +451,13 @@ def formatAns(num: float, pattern: str) -> str:
     
 def getTolerance(problemData: dict, variables: dict) -> Tuple[str, float]:
     if (tolRpr := problemData.get("tolerance")) is not None:
+        tolRpr = evaluateEmbeddedExprs(tolRpr, variables)
         if tolRpr.endswith("%"):
             tol = float(tolRpr[:-1])/100
             tolType = "rtol"
             
         else:
-            tol = float(evaluateEmbeddedExprs(tolRpr, variables)) 
+            tol = float(tolRpr) 
             tolType = "atol"
     else:
         tolType = "atol"
@@ -405,17 +478,79 @@ def genVariables(_scope2Script: list[tuple[str, str]], _scope2Exprs: dict[str, d
     return _res
 
 
+# variables.py generated along with data.json holds the scripts and embedded expressions
+# of a question compiled into a single function, compile it once per process and version of the question
+# by path, along with the mtime of variables.py and the hash of the data.json it was compiled with
+_variableGenerators = dict()
+
+def loadVariableGenerator(questionPath: str, problemHash: str):
+    generatorPath = questionPath + "/variables.py"
+    mtime = os.stat(generatorPath).st_mtime_ns if os.path.isfile(generatorPath) else None
+    cached = _variableGenerators.get(questionPath)
+    if cached is None or cached[0] != mtime or cached[1] != problemHash:
+        variableGenerator = None
+        if mtime is not None:
+            with open(generatorPath, "r") as f:
+                code = compile(f.read(), generatorPath, "exec")
+            namespace = dict(globals())     # scripts call the lon-capa built-ins defined in this module
+            exec(code, namespace)
+            variableGenerator = namespace["genQuestionVariables"]
+        cached = (mtime, problemHash, variableGenerator)
+        _variableGenerators[questionPath] = cached
+    return cached[2]
+
+
+# data.json decoded once per process and question, by path, along with the mtime it was read at and its hash
+_problemDataCache = dict()
+# the versions of data.json of each question read by the process, by path and the sha256 of their content
+# only the most recent ones are kept, older variants are parsed with the current version
+_problemVersions = dict()
+_max_problem_versions = 4
+
+# the problem data is shared by every generate() and parse() call of the question, treat it as read-only
+def loadProblemFile(questionPath: str) -> Tuple[dict, str]:
+    problemDataPath = questionPath + "/data.json"
+    mtime = os.stat(problemDataPath).st_mtime_ns
+    cached = _problemDataCache.get(problemDataPath)
+    if cached is None or cached[0] != mtime:
+        with open(problemDataPath, "rb") as f:
+            content = f.read()
+        problemHash = hashlib.sha256(content).hexdigest()
+        versions = _problemVersions.setdefault(questionPath, dict())
+        if problemHash in versions:
+            problemData = versions.pop(problemHash)
+        else:
+            problemData = json.loads(content)
+        versions[problemHash] = problemData     # the current version is the last one inserted
+        if len(versions) > _max_problem_versions:
+            versions.pop(next(iter(versions)))
+        cached = (mtime, problemData, problemHash)
+        _problemDataCache[problemDataPath] = cached
+    return cached[1], cached[2]
+
+# the problem data the variant was generated from if the process still has it,
+# otherwise the current one, which is the only one variants stored without a hash know of
 def loadProblemData(plData: dict) -> dict:
-    if not plData["params"].get("problemDataLoaded", False):
-        problemDataPath = plData["options"]["question_path"] + "/data.json"
-        with open(problemDataPath, "r") as f:
-            plData["params"]["problemDataStr"] = f.read()
-        plData["params"]["problemDataLoaded"] = True
-
-    problemData = json.loads(plData["params"]["problemDataStr"])
+    questionPath = plData["options"]["question_path"]
+    problemData, problemHash = loadProblemFile(questionPath)
+    variantHash = plData["params"].get("problemHash")
+    if variantHash is not None and variantHash != problemHash:
+        problemData = _problemVersions[questionPath].get(variantHash, problemData)
     return problemData
 
 
+# the generated variables question.html renders, data.json built before renderedExprs
+# was recorded keeps all of them
+def compactVariables(variables: dict, renderedExprs: dict|None) -> dict:
+    if renderedExprs is None:
+        return variables
+    compacted = dict()
+    for scope, exprNames in renderedExprs.items():
+        inScopeVars = variables.get(scope, {})
+        compacted[scope] = {name: inScopeVars[name] for name in exprNames if name in inScopeVars}
+    return compacted
+
+
 
 
 # counts #significant number for int and float representations
@@ -441,16 +576,22 @@ def countNumSig(num: str) -> int:
             count += 1
     return count
 
+_embeddedExprRegex = re.compile("{{(value-\\d+)}}")
+
 # replace placeholders with actual values generated by the script
-def evaluateEmbeddedExprs(text: str, variables: dict) -> str:
-    def replace(matched):
-        valueName = matched.group(0).strip("}{").split(".")[-1]
+# the converter stores templates as segments alternating between literal text and variable names,
+# templates of data.json built before that are strings and still go through the regex
+def evaluateEmbeddedExprs(template: str|list, variables: dict) -> str:
+    if isinstance(template, list):
+        parts = template.copy()
+        for i in range(1, len(parts), 2):
+            parts[i] = str(variables[parts[i]]) if parts[i] in variables else "{{" + parts[i] + "}}"
+        return "".join(parts)
 
-        return str(variables.get(valueName, matched.group(0)))
+    def replace(matched):
+        return str(variables.get(matched.group(1), matched.group(0)))
 
-    res = re.sub("{{value-\d+}}", replace, text)
-    
-    return res
+    return _embeddedExprRegex.sub(replace, str(template))
 
 
 
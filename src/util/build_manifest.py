@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import (List, Tuple)
+from util.logger import logger
+
+
+_manifest_path = "out/build_manifest.json"
+
+# the files and packages under src that shape the generated output: the converter code, the
+# server.py template and lon_capa_util. The benchmarks and pregenerate.py are left out
+_toolchain_dir = "src"
+_toolchain_paths = ["main.py", "flags.py", "lon_capa_util.py", "templates/server.py", "parsers", "perl_translator", "util"]
+_toolchain_suffixes = [".py"]
+
+
+
+# persistent record of the sources each converted question was generated from
+# a question group is only re-converted when its sources, the toolchain or the conversion options change
+class BuildManifest():
+
+    def __init__(self, options: dict|None = None, manifestPath: str = _manifest_path) -> None:
+        self._manifestPath = manifestPath
+        self._toolchainHash = BuildManifest._hashToolchain({} if options is None else options)
+        self._groups: dict[str, dict] = dict()   # problem key -> {"sources": {path: hash}, "converted": [path, id]|None}
+
+        if not Path(manifestPath).is_file():
+            return
+        try:
+            with open(manifestPath, "r", encoding="utf-8") as f:
+                manifest = json.loads(f.read())
+        except Exception as e:
+            logger.warning("Ignoring unreadable build manifest %s: %s" % (manifestPath, e))
+            return
+        if manifest.get("toolchain") != self._toolchainHash:
+            logger.info("Toolchain changed since last build, rebuilding all questions")
+            return
+        self._groups = manifest.get("groups", {})
+
+
+    def isEmpty(self) -> bool:
+        return len(self._groups) == 0
+
+
+    def reset(self) -> None:
+        self._groups = dict()
+
+
+    # hash every file under the given question dirs
+    @staticmethod
+    def hashSources(paths: List[str]) -> dict[str, str]:
+        return {path: BuildManifest._hashTree(path) for path in paths}
+
+
+    # returns True if the group was converted from exactly these sources before
+    # and its output is still in place
+    def isUpToDate(self, key: str, sources: dict[str, str], outputDir: str) -> bool:
+        group = self._groups.get(key)
+        if group is None or group["sources"] != sources:
+            return False
+        converted = group["converted"]
+        return converted is None or Path(outputDir + "/" + converted[1]).is_dir()
+
+
+    def getConverted(self, key: str) -> Tuple[str, str]|None:
+        group = self._groups.get(key)
+        if group is None or group["converted"] is None:
+            return None
+        return tuple(group["converted"])
+
+
+    def record(self, key: str, sources: dict[str, str], converted: Tuple[str, str]|None) -> None:
+        self._groups[key] = {
+            "sources": sources,
+            "converted": None if converted is None else list(converted)
+        }
+
+
+    # forget a group, it is converted again by the next build
+    def forget(self, key: str) -> None:
+        self._groups.pop(key, None)
+
+
+    # forget groups whose sources disappeared, the caller removes every output
+    # no recorded group was converted to, including theirs
+    def prune(self, keys: set[str]) -> None:
+        for key in list(self._groups.keys()):
+            if key not in keys:
+                self._groups.pop(key)
+
+
+    def save(self) -> None:
+        manifest = {
+            "toolchain": self._toolchainHash,
+            "groups": self._groups
+        }
+        with open(self._manifestPath, "w", encoding="utf-8") as f:
+            f.write(json.dumps(manifest, indent=4, sort_keys=True))
+
+
+    @staticmethod
+    def _hashToolchain(options: dict) -> str:
+        hasher = hashlib.sha256()
+        hasher.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        for toolchainPath in _toolchain_paths:
+            path = os.path.join(_toolchain_dir, toolchainPath)
+            if os.path.isfile(path):
+                BuildManifest._updateWithFile(hasher, path, _toolchain_dir)
+                continue
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for file in sorted(files):
+                    if os.path.splitext(file)[1] in _toolchain_suffixes:
+                        BuildManifest._updateWithFile(hasher, os.path.join(root, file), _toolchain_dir)
+        return hasher.hexdigest()
+
+
+    @staticmethod
+    def _hashTree(path: str) -> str:
+        hasher = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                BuildManifest._updateWithFile(hasher, os.path.join(root, file), path)
+        return hasher.hexdigest()
+
+
+    @staticmethod
+    def _updateWithFile(hasher, filePath: str, basePath: str) -> None:
+        hasher.update(os.path.relpath(filePath, basePath).encode("utf-8"))
+        hasher.update(b"\0%d\0" % os.path.getsize(filePath))
+        with open(filePath, "rb") as f:
+            while (chunk := f.read(1 << 20)):
+                hasher.update(chunk)
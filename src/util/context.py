@@ -3,13 +3,14 @@ from typing import (List, Any)
 from pathlib import Path
 from util.execution_manager import ExecutionManager
 import json
-import shutil
 import os
 import uuid
-import pystache
 import re
-from html import escape, unescape
 from util.logger import logger
+from util.variant_profiler import profileVariants, checkVariantProfile
+from util.question_html import buildQuestionHtml
+from util.resource_store import ResourceStore
+from util.output_sink import getOutputSink
 
 from . import exceptions
 
@@ -18,6 +19,182 @@ from . import exceptions
 
 #todo: initialize output dir
 _base_output_dir = "out/questions"
+_server_files_course_dir = "out/serverFilesCourse"
+
+# package under serverFilesCourse holding the question runtime when it is shared by all questions
+_shared_runtime_package = "lon_capa_runtime"
+
+# characters read at a time by the streaming problem loader, expat rescans an unfinished
+# token on every feed so chunks should not be much smaller than a large inline image
+_xml_chunk_size = 1024 * 1024
+
+# static resources of all questions, deduplicated by content and hardlinked into each question
+RESOURCE_STORE_DIR = "out/.resource_store"
+_resource_store = ResourceStore(RESOURCE_STORE_DIR)
+
+# variant profiles of the questions by problem name, a build diagnostic kept out of the course
+VARIANT_PROFILE_DIR = "out/variant_profiles"
+
+
+# links to other sites are not resources of the question
+_urlSchemeRegex = re.compile("[a-zA-Z][a-zA-Z0-9+.-]*:")
+_htmlLinkRegex = re.compile("(?:src|href)\\s*=\\s*[\"']([^\"'#?]+)")
+# names interpolated from problem variables, such as <img src="$fig">, are only known at runtime
+_dynamicReferenceRegex = re.compile("[$@{}]")
+
+_script_open_tag = '<script type="loncapa/perl">'
+_script_close_tag = "</script>"
+# script tags are only recognized when some text follows them
+_scriptMarkerRegex = re.compile("({}|{})(?=[\\s\\S])".format(re.escape(_script_open_tag), re.escape(_script_close_tag)))
+_scriptEscapeRegex = re.compile("&(?!amp;)|[<>]")
+# every alternative starts with a literal so the regex engine can skip ahead to candidates
+_textEscapeRegex = re.compile("&(?!amp;)|<(?=\\s)|>(?<=\\s>)")
+_scriptEscapes = {"&": "&amp;", "<": "&lt;", ">": "&gt;"}
+
+
+def _escapeScriptChar(matched: re.Match) -> str:
+    return _scriptEscapes[matched.group(0)]
+
+
+# escape dangling &s, and <, > next to whitespace, which is normalized to a single space
+def _escapeText(text: str) -> str:
+    escaped = []
+    cursor = 0
+    for matched in _textEscapeRegex.finditer(text):
+        i = matched.start()
+        if text[i] == "&":
+            escaped.append(text[cursor:i])
+            escaped.append("&amp;")
+            cursor = i + 1
+        elif text[i] == "<":
+            escaped.append(text[cursor:i])
+            escaped.append("&lt; ")
+            cursor = i + 2
+        elif cursor > i - 1:    # the whitespace was already emitted after an escaped <
+            escaped.append("&gt;")
+            cursor = i + 1
+        else:
+            escaped.append(text[cursor:i-1])
+            escaped.append(" &gt;")
+            cursor = i + 1
+    escaped.append(text[cursor:])
+    return "".join(escaped)
+
+
+# escape characters and replace xml special chars
+# single scan over the script markers: script bodies get &, <, > escaped,
+# text outside scripts gets dangling &s and <, > next to whitespace escaped
+def cleanXml(xml: str) -> str:
+    return _cleanXmlSegment(xml, False)[0]
+
+
+# escape a segment of problem xml starting inside a script or not,
+# returns the escaped segment and whether it ends inside a script
+def _cleanXmlSegment(xml: str, inScript: bool) -> tuple[str, bool]:
+    escaped = []
+    cursor = 0
+    for marker in _scriptMarkerRegex.finditer(xml):
+        segment = xml[cursor:marker.start()]
+        if inScript:
+            escaped.append(_scriptEscapeRegex.sub(_escapeScriptChar, segment))
+        else:
+            escaped.append(_escapeText(segment))
+        escaped.append(marker.group(0))
+        inScript = marker.group(0) == _script_open_tag
+        cursor = marker.end()
+
+    segment = xml[cursor:]
+    if inScript:
+        escaped.append(_scriptEscapeRegex.sub(_escapeScriptChar, segment))
+    else:
+        escaped.append(_escapeText(segment))
+    return "".join(escaped), inScript
+
+
+# cleanXml over text fed in chunks of any size, the output is the same as cleaning it at once
+# the end of a chunk is held back until the escapes and script markers it may start are complete:
+# a < can start a marker or be escaped along with the whitespace after it, an & is escaped
+# unless amp; follows and whitespace before a > is replaced along with it
+class XmlSanitizer():
+
+    def __init__(self) -> None:
+        self._pending = ""
+        self._inScript = False
+
+
+    # returns the escaped text that is final so far
+    def feed(self, chunk: str) -> str:
+        buffer = self._pending + chunk
+        end = XmlSanitizer._finalEnd(buffer)
+        if end <= 0:
+            self._pending = buffer
+            return ""
+        escaped, self._inScript = _cleanXmlSegment(buffer[:end], self._inScript)
+        self._pending = buffer[end:]
+        return escaped
+
+
+    def close(self) -> str:
+        escaped, self._inScript = _cleanXmlSegment(self._pending, self._inScript)
+        self._pending = ""
+        return escaped
+
+
+    # end of the text that can be escaped without seeing more, a script marker is only
+    # recognized when some text follows it so the text cannot end with one either
+    @staticmethod
+    def _finalEnd(buffer: str) -> int:
+        end = len(buffer) - len(_script_open_tag)
+        while end > 0:
+            cut = end
+            while cut > 0 and buffer[cut-1].isspace():
+                cut -= 1
+            # markers hold no <, only the last one can start a marker that is not complete yet
+            if (i := buffer.rfind("<", max(0, cut - len(_script_open_tag)), cut)) >= 0 and \
+                    (_script_open_tag.startswith(buffer[i:cut]) or _script_close_tag.startswith(buffer[i:cut])):
+                cut = i
+            if (i := buffer.rfind("&", max(0, cut - len("amp;")), cut)) >= 0:
+                cut = i
+            for tag in [_script_open_tag, _script_close_tag]:
+                if buffer.endswith(tag, 0, cut):
+                    cut -= len(tag)
+            if cut == end:
+                break
+            end = cut
+        return end
+
+
+
+# generated variables the problem text renders, the runtime keeps only these in the variant params
+_renderedExprRegex = re.compile("params\\.generatedVars\\.(.+?)\\.(value-\\d+)\\}")
+
+# placeholders of generated variables in the text the runtime renders per variant
+_embeddedExprRegex = re.compile("{{(value-\\d+)}}")
+_templated_question_fields = ["answerValue", "tolerance"]
+_templated_foil_fields = ["foilPrompt", "answerValue", "rank"]
+
+
+# split a templated string into segments alternating between literal text and the name of a
+# generated variable, starting and ending with a literal, so the runtime renders it with a join
+def tokenizeTemplate(text: Any) -> list[str]:
+    return _embeddedExprRegex.split(str(text))
+
+
+def _tokenizeFields(data: dict, fields: list[str]) -> dict:
+    return {key: tokenizeTemplate(value) if key in fields and value is not None else value for key, value in data.items()}
+
+
+# copy of a question of data.json with the strings rendered per variant tokenized
+def compileQuestionTemplates(question: dict) -> dict:
+    compiled = _tokenizeFields(question, _templated_question_fields)
+    if "foils" in question:
+        compiled["foils"] = []
+        for foil in question["foils"]:
+            foil = _tokenizeFields(foil, _templated_foil_fields)
+            if "candidates" in foil:
+                foil["candidates"] = [_tokenizeFields(candidate, _templated_foil_fields) for candidate in foil["candidates"]]
+            compiled["foils"].append(foil)
+    return compiled
 
 
 
@@ -25,33 +202,57 @@ _base_output_dir = "out/questions"
 # one for each problem
 class Context():
 
-    def __init__(self, srcQuestionDir: str) -> None:
-        problemFileFound = False
-        for file in os.listdir(srcQuestionDir):
-            filePath = srcQuestionDir + "/" + str(file)
-            if os.path.isfile(filePath) and filePath.endswith(".problem"):
-                self.xmlRoot = self._parseXml(filePath)
-                if self.xmlRoot.find("problem") is None:
-                    raise exceptions.INVALID_PROBLEM_DEFINITION
-                self.problemName = str(srcQuestionDir).split("/")[1] + "-" + str(file).split(".")[0]
-                problemFileFound = True
-                break 
-        if not problemFileFound:
+    def __init__(self, srcQuestionDir: str, varDiscovery: str = ExecutionManager.VAR_DISCOVERY_EXEC, sharedRuntime: bool = False,
+                 profileSamples: int = 0, prettyHtml: bool = False,
+                 allResources: bool = False, streamXml: bool = False,
+                 variantAttempts: int = 0, variantBatch: int = 0) -> None:
+        problemFile = Context.findProblemFile(srcQuestionDir)
+        if problemFile is None:
             raise exceptions.PROBLEM_FILE_NOT_FOUND
+        problemPath = srcQuestionDir + "/" + problemFile
+        # a file that fits in a chunk is loaded whole, which is faster
+        if streamXml and os.path.getsize(problemPath) > _xml_chunk_size:
+            self.xmlRoot = Context._parseXmlStreaming(problemPath)
+        else:
+            self.xmlRoot = self._parseXml(problemPath)
+        if self.xmlRoot.find("problem") is None:
+            raise exceptions.INVALID_PROBLEM_DEFINITION
+        self.problemName = Context.getProblemName(srcQuestionDir, problemFile)
         
         self._problemData = dict()
         self._problemData["questions"] = []
-        self._executionManager = ExecutionManager()
+        self._executionManager = ExecutionManager(varDiscovery)
 
         self._srcQuestionDir = srcQuestionDir + "/"
         self._dstQuestionDir: str = _base_output_dir + "/" + self.problemName + "/"
         self._exprCounter = 1
         self._ansCounter = 1
+        self._sharedRuntime = sharedRuntime
+        self._profileSamples = profileSamples
+        self._prettyHtml = prettyHtml
+        self._allResources = allResources
+        # sampling budget of generate() written to data.json, 0 keeps the runtime default
+        self._variantAttempts = variantAttempts
+        self._variantBatch = variantBatch
+        self._referencedResources: set[str] = set()
         
         
 
 
     
+    # locate the lon-capa problem definition file under a question dir
+    @staticmethod
+    def findProblemFile(srcQuestionDir: str) -> str|None:
+        for file in os.listdir(srcQuestionDir):
+            filePath = srcQuestionDir + "/" + str(file)
+            if os.path.isfile(filePath) and filePath.endswith(".problem"):
+                return str(file)
+        return None
+
+    @staticmethod
+    def getProblemName(srcQuestionDir: str, problemFile: str) -> str:
+        return str(srcQuestionDir).split("/")[1] + "-" + problemFile.split(".")[0]
+
     def getAnswerId(self) -> str:
         id = "ans-"+str(self._ansCounter)
         self._ansCounter += 1
@@ -62,49 +263,6 @@ class Context():
     def openNewQuestion(self) -> None:
         self._problemData["questions"].append(dict())
 
-    # escape characters and replace xml special chars
-    def _cleanXml(self, xml: str) -> str:
-
-        # escape all dangling '&'s
-        escaped = []
-        for i in range(len(xml)):
-            if xml[i] == "&" and xml[i:i+5] != "&amp;":
-                escaped.append("&amp;")
-            else:
-                escaped.append(xml[i])
-        xml = "".join(escaped)
-
-        #escape <, > within script
-        start = False
-        escaped = []
-        i = 0
-        while i<len(xml):
-            if i+28 < len(xml) and xml[i:i+28] == '<script type="loncapa/perl">':
-                start = True
-                escaped.append('<script type="loncapa/perl">')
-                i += 28
-            elif i+9 < len(xml) and xml[i:i+9] == "</script>":
-                start = False
-                escaped.append("</script>")
-                i += 9
-            elif start:
-                if xml[i] == "<":
-                    escaped.append("&lt;")
-                elif xml[i] == ">":
-                    escaped.append("&gt;")
-                else:
-                    escaped.append(xml[i])
-                i += 1
-            else:
-                escaped.append(xml[i])
-                i += 1
-        xml = "".join(escaped)
-
-        xml = re.sub("<\\s", "&lt; ", xml)
-        xml = re.sub("\\s>", " &gt;", xml)
-        return xml
-    
-
     def _parseXml(self, path) -> ET.Element:
         with open(path, "r", encoding="utf-8") as f:
             xml = f.read()
@@ -114,9 +272,44 @@ class Context():
         if "<customresponse" in xml:
             raise exceptions.CUSTOM_RESPONSE_NOT_SUPPORTED
         xml = "<root>" + xml + "</root>"
-        xml = self._cleanXml(xml)
+        xml = cleanXml(xml)
         return ET.fromstring(xml)
-    
+
+
+    # same as _parseXml, reading the file in chunks that are sanitized and fed to a pull parser as
+    # they come, so beyond the tree only about a chunk of the raw and escaped text is held at a time
+    @staticmethod
+    def _parseXmlStreaming(path, chunkSize: int = _xml_chunk_size) -> ET.Element:
+        sanitizer = XmlSanitizer()
+        parser = ET.XMLPullParser(events=("start",))
+        root = None
+
+        def feed(text: str) -> None:
+            nonlocal root
+            parser.feed(sanitizer.feed(text))
+            # drain the events as they come, only the first one is needed
+            for _, elem in parser.read_events():
+                root = elem if root is None else root
+
+        feed("<root>")
+        tail = ""
+        with open(path, "r", encoding="utf-8") as f:
+            while len(chunk := f.read(chunkSize)) > 0:
+                # keep enough of the previous chunk to find the markers straddling the cut
+                window = tail + chunk
+                if "<html>" in window:
+                    raise exceptions.HTML_NOT_SUPPORTED
+                if "<customresponse" in window:
+                    raise exceptions.CUSTOM_RESPONSE_NOT_SUPPORTED
+                tail = window[-len("<customresponse"):]
+                feed(chunk)
+        feed("</root>")
+        parser.feed(sanitizer.close())
+        parser.close()
+        for _, elem in parser.read_events():
+            root = elem if root is None else root
+        return root
+
 
     def genTargetResource(self) -> None:
         dstPath = Path(self._dstQuestionDir)
@@ -131,7 +324,14 @@ class Context():
         self._genProblemMetadata()
         self._genProblemHtml()
         self._genServerScript()
-        self._dumpProblemData()
+        generatorCode = self._genVariableGenerator()
+        data = self._dumpProblemData()
+        if self._profileSamples > 0 and not self._executionManager.executesScripts():
+            logger.warning("Skipping variant profiling of %s, it runs the problem scripts which static variable discovery does not" % self.problemName)
+        elif self._profileSamples > 0 and generatorCode is None:
+            logger.warning("Not profiling variants of %s, it has no variables.py" % self.problemName)
+        elif self._profileSamples > 0:
+            self._profileVariants(generatorCode, data)
 
 
 
@@ -139,11 +339,15 @@ class Context():
 
 
     # write data used for rendering the question to file 
-    def _dumpProblemData(self) -> None:
+    def _dumpProblemData(self) -> dict:
         data = dict()
         data["script"] = self._executionManager.dumpScripts()
         data["questions"] = dict()
         data["embeddedExprs"] = self._executionManager.dumpReferences()
+        data["renderedExprs"] = self._findRenderedExprs()
+        sampling = {"maxAttempts": self._variantAttempts, "batchSize": self._variantBatch}
+        if len(sampling := {key: value for key, value in sampling.items() if value > 0}) > 0:
+            data["sampling"] = sampling
         for question in self._problemData["questions"]:
             
             if not "answerId" in question:
@@ -152,45 +356,99 @@ class Context():
             if "hint" in question:
                 question.pop("hint")
             ansId = question.pop("answerId")
-            data["questions"][ansId] = question
+            data["questions"][ansId] = compileQuestionTemplates(question)
         
             
-        data = json.dumps(data, indent=4)
-        with open(self._dstQuestionDir + "data.json", "w") as f:
-            f.write(data)
+        self._writeFile("data.json", json.dumps(data, indent=4))
+        return data
+
 
+    # scope -> names of the generated variables referenced by prompts, hints and the tail of the problem
+    def _findRenderedExprs(self) -> dict[str, list[str]]:
+        texts = [self._problemData.get("tail") or ""]
+        for question in self._problemData["questions"]:
+            texts.append(question.get("prompt") or "")
+            if (hint := question.get("hint")):
+                texts += [hint.get("precedingText") or "", hint.get("prompt") or ""]
+        rendered: dict[str, list[str]] = dict()
+        for text in texts:
+            for scope, exprName in _renderedExprRegex.findall(text):
+                if exprName not in (names := rendered.setdefault(scope, [])):
+                    names.append(exprName)
+        return rendered
 
 
+    # sample the question variants offline and record how often generate() would have to retry
+    def _profileVariants(self, generatorCode: str, data: dict) -> None:
+        profile = profileVariants(Context._genRuntimeCode(), generatorCode, data, self._profileSamples)
+        checkVariantProfile(self.problemName, profile)
+        Path(VARIANT_PROFILE_DIR).mkdir(parents=True, exist_ok=True)
+        getOutputSink().writeText(self.problemName, Context.variantProfilePath(self.problemName), json.dumps(profile, indent=4))
+
+
+    @staticmethod
+    def variantProfilePath(problemName: str) -> str:
+        return VARIANT_PROFILE_DIR + "/" + problemName + ".json"
+
+
+
+    # question.html is built as a tree in one pass over the problem data, it is not written
+    # when the problem markup is not well formed
     def _genProblemHtml(self) -> None:
-        htmlPath = "src/templates/question.html"
-        data = self._problemData
-        with open(htmlPath, "r", encoding="utf-8") as f:
-            template = f.read()
-            
-        rendered = pystache.render(template, data)
-        rendered = rendered.replace("\\{", "{")
-        rendered = rendered.replace("\\}", "}")
-        rendered = re.sub("\\&#?\\w+\\;", lambda x: escape(unescape(x.group(0))), rendered)
         try:
-            elem = ET.fromstring(rendered)
-        except Exception as e:
-            logger.warning(f"failed to parse \n {rendered} \n with error {e}")
+            elem = buildQuestionHtml(self._problemData)
+        except ET.ParseError as e:
+            logger.warning("failed to build question.html of %s: %s" % (self.problemName, e))
             return
-        ET.indent(elem)
-        with open(self._dstQuestionDir + "question.html", "w", encoding="utf-8") as f:
-            f.write(ET.tostring(elem, encoding="unicode", short_empty_elements=False))
+        if self._prettyHtml:
+            ET.indent(elem)
+        self._writeFile("question.html", ET.tostring(elem, encoding="unicode", short_empty_elements=False), encoding="utf-8")
 
 
-    def _genServerScript(self) -> None:
+    # server.py template followed by the lon-capa built-in functions its scripts call
+    @staticmethod
+    def _genRuntimeCode() -> str:
         scriptPath = "src/templates/server.py"
         lonCapaUtilPath = "src/lon_capa_util.py"
         with open(scriptPath, "r") as f:
             script = f.read()
         with open(lonCapaUtilPath, "r") as f:
             lon_capa_util = f.read()
-        code = script + "\n" + lon_capa_util
-        with open(self._dstQuestionDir + "server.py", "w") as f:
-            f.write(code)
+        return script + "\n" + lon_capa_util
+
+
+    # write the runtime once as a package under serverFilesCourse,
+    # which prairielearn puts on the python path of every question
+    @staticmethod
+    def genSharedRuntime() -> None:
+        dstPath = Path(Context.sharedRuntimeDir())
+        if not dstPath.exists():
+            dstPath.mkdir(parents=True)
+        with open(str(dstPath) + "/__init__.py", "w") as f:
+            f.write(Context._genRuntimeCode())
+
+
+    @staticmethod
+    def sharedRuntimeDir() -> str:
+        return _server_files_course_dir + "/" + _shared_runtime_package
+
+
+    def _genServerScript(self) -> None:
+        if self._sharedRuntime:
+            code = "from {} import generate, parse\n".format(_shared_runtime_package)
+        else:
+            code = Context._genRuntimeCode()
+        self._writeFile("server.py", code)
+
+
+    # precompiled counterpart of the scripts in data.json, loaded once per process by server.py
+    def _genVariableGenerator(self) -> str|None:
+        code = self._executionManager.dumpVariableGenerator()
+        if code is None:
+            logger.warning("falling back to runtime script execution for problem %s" % self.problemName)
+            return None
+        self._writeFile("variables.py", code)
+        return code
 
 
     def _genProblemMetadata(self) -> None:
@@ -203,8 +461,12 @@ class Context():
             "comment": "You can add comments to JSON files using this property."
         }
 
-        with open(self._dstQuestionDir + "info.json", "w") as f:
-            f.write(json.dumps(metadata, indent=4))
+        self._writeFile("info.json", json.dumps(metadata, indent=4))
+
+
+    # files are written through the output sink of the process, possibly in the background
+    def _writeFile(self, fileName: str, content: str, encoding: str|None = None) -> None:
+        getOutputSink().writeText(self.problemName, self._dstQuestionDir + fileName, content, encoding)
 
     
     def setPrompt(self, prompt: str) -> None:
@@ -233,6 +495,7 @@ class Context():
                 logger.warning("Unable to locate file %s while parsing hint" % link)
                 continue
             elem["name"] = name
+            self.addResourceReference(name)
             if len(name.split(".")) > 1:
                 suffix = name.split(".")[-1]
                 if suffix in ["html", "htm"]:
@@ -286,8 +549,46 @@ class Context():
     def getVisibleVariablesNames(self, scope: str) -> set[str]:
         return self._executionManager.getLocalVarNames(scope)
 
+    # record a file of res/ the problem refers to by link or file name
+    def addResourceReference(self, link: str) -> None:
+        if _urlSchemeRegex.match(link) is not None:
+            return
+        name = link.split("/")[-1]
+        if len(name) > 0:
+            self._referencedResources.add(name)
+
+
+    # files of res/ referenced by the problem, or by a referenced html file such as a hint page
+    # all of them when some reference is only known at runtime
+    # missing references are warned about and unreferenced files reported
+    def _findReferencedResources(self, srcPath: str, files: List[str]) -> List[str]:
+        available = set(files)
+        referenced = set()
+        pending = list(self._referencedResources)
+        while len(pending) > 0:
+            name = pending.pop()
+            if name in referenced:
+                continue
+            referenced.add(name)
+            if name in available and name.split(".")[-1].lower() in ["html", "htm"]:
+                with open(srcPath + "/" + name, "r", encoding="utf-8", errors="replace") as f:
+                    for link in _htmlLinkRegex.findall(f.read()):
+                        if _urlSchemeRegex.match(link) is None and len(link.split("/")[-1]) > 0:
+                            pending.append(link.split("/")[-1])
+
+        if len(dynamic := sorted(name for name in referenced if _dynamicReferenceRegex.search(name) is not None)) > 0:
+            logger.info("Copying all files of %s, it references %s" % (srcPath, ", ".join(dynamic)))
+            return files
+        if len(missing := sorted(referenced - available)) > 0:
+            logger.warning("Referenced files missing from %s: %s" % (srcPath, ", ".join(missing)))
+        if len(unreferenced := sorted(available - referenced)) > 0:
+            logger.info("Skipping %d unreferenced files of %s: %s" % (len(unreferenced), srcPath, ", ".join(unreferenced)))
+        return [file for file in files if file in referenced]
+
+
     #copy a file under src question dir to dst question file dir
     def moveStaticResources(self) -> None:
+        _resource_store.resetReferences(self.problemName)
         srcPath = self._srcQuestionDir + "res"
         if not Path(srcPath).exists():
             return
@@ -295,11 +596,11 @@ class Context():
         if not dstPath.exists():
             dstPath.mkdir(parents=True)
         srcPath = self._srcQuestionDir + "/res"
-        for file in os.listdir(srcPath):
-            try:
-                shutil.copy(srcPath + "/" + file, str(dstPath))
-            except Exception as e:
-                logger.error("Error moving static files: %s" % str(e))
+        files = os.listdir(srcPath)
+        if not self._allResources:
+            files = self._findReferencedResources(srcPath, files)
+        for file in files:
+            getOutputSink().submit(self.problemName, _resource_store.materialize, self.problemName, srcPath + "/" + file, str(dstPath / file))
 
 
 
@@ -1,17 +1,63 @@
-import copy
+import ast
+from types import CodeType
 from util.logger import logger
+from util.static_analysis import collectAssignedNames
 import sys
 
+
+_lon_capa_util_path = "src/lon_capa_util.py"
+_libNamespace: dict|None = None
+
+
+# lon-capa built-in library executed once per process,
+# every scope namespace starts from a copy of it
+def getLibNamespace() -> dict:
+    global _libNamespace
+    if _libNamespace is None:
+        with open(_lon_capa_util_path, "r", encoding="utf-8") as f:
+            libScript = f.read()
+        _libNamespace = dict()
+        exec(compile(libScript, _lon_capa_util_path, "exec"), _libNamespace)
+    return _libNamespace
+
+
+_libNames: set[str]|None = None
+
+
+# names defined by the lon-capa built-in library, found without executing it
+def getLibNames() -> set[str]:
+    global _libNames
+    if _libNames is None:
+        with open(_lon_capa_util_path, "r", encoding="utf-8") as f:
+            _libNames = collectAssignedNames(f.read())
+    return _libNames
+
+
 # manages lon-capa script dynamic execution
 # and embedded expression scope bindings
 class ExecutionManager():
     
     SCOPE_DEFAULT = "__SCOPE_DEFAULT__"
 
-    def __init__(self) -> None:
+    # how visible variable names are discovered:
+    # by executing the scripts, or statically from the names they assign
+    VAR_DISCOVERY_EXEC = "exec"
+    VAR_DISCOVERY_STATIC = "static"
+
+    # name of the function generated by dumpVariableGenerator
+    VARIABLE_GENERATOR = "genQuestionVariables"
+
+    def __init__(self, varDiscovery: str = VAR_DISCOVERY_EXEC) -> None:
+        if varDiscovery not in [ExecutionManager.VAR_DISCOVERY_EXEC, ExecutionManager.VAR_DISCOVERY_STATIC]:
+            raise Exception("Unknown variable discovery mode " + varDiscovery)
+        self._varDiscovery = varDiscovery
         self._scope2script: list[tuple[str, str]] = list()
         self._scope2reference: dict[str, dict[str, str]] = dict()
+        self._scope2exprName: dict[str, dict[str, str]] = dict()  #scope -> expr -> reference name
         self._scope2varNames: dict[str, list[str]] = dict()  #scope -> visible local vars
+        self._scope2namespace: dict[str, dict] = dict()  #scope -> namespace after running scripts up to the scope
+        self._scope2code: dict[str, CodeType] = dict()
+        self._scope2assignedNames: dict[str, set[str]] = dict()  #scope -> names assigned by the scope script
         self._exprCounter: int = 0
     
 
@@ -19,76 +65,110 @@ class ExecutionManager():
         for i in range(len(self._scope2script)):
             if scope == self._scope2script[i][0]:
                 self._scope2script[i] = (scope, script)
+                # namespaces are chained, later scopes have to be re-run as well
+                for scope1, _ in self._scope2script[i:]:
+                    self._scope2namespace.pop(scope1, None)
+                self._scope2code.pop(scope, None)
+                self._scope2assignedNames.pop(scope, None)
+                self._scope2varNames.clear()
                 return
         self._scope2script.append((scope, script))
+        self._scope2varNames.clear()
 
 
     # returns references name
+    # identical expressions under the same scope share one reference
     def addReference(self, scope: str, expr: str) -> str:
         if not scope in self._scope2reference:
             self._scope2reference[scope] = dict()
+            self._scope2exprName[scope] = dict()
         
-        for name, expression in self._scope2reference.items():
-            if expression == expr:
-                return name 
+        if (name := self._scope2exprName[scope].get(expr)) is not None:
+            return name 
             
         newName =  "value-" + str(self._exprCounter)
         self._exprCounter += 1
         self._scope2reference[scope][newName] = expr
+        self._scope2exprName[scope][expr] = newName
         return newName
     
-    # execute a python script and obtain locals
-    def _execute(self, __pyScript: str) -> dict:
+
+    def _getCode(self, scope: str, script: str) -> CodeType:
+        if (code := self._scope2code.get(scope)) is None:
+            code = compile(script, "<script %s>" % scope, "exec")
+            self._scope2code[scope] = code
+        return code
+
+
+    # execute a scope script on top of a namespace, in place
+    def _execute(self, scope: str, script: str, namespace: dict) -> dict:
         try:
-            exec(__pyScript)
+            exec(self._getCode(scope, script), namespace)
         except Exception as e:
-            logger.error("Error running script: %s" % __pyScript)
+            logger.error("Error generating local variable names for scope %s" % scope)
+            logger.error("Error running script: %s" % script)
             logger.error(e, exc_info=True)
             sys.exit(1)
+        return namespace
 
-        res = locals()
-        return res
-    
 
-    def getLocalVarNames(self, scope: str) -> set[str]:
-        if scope in self._scope2varNames:
-            return self._scope2varNames[scope]
-        
-        scripts = []
-        with open("src/lon_capa_util.py", "r", encoding="utf-8") as f:
-            libScript = f.read()
-            scripts.append(libScript)
+    # run each scope script once, on a shallow copy of the namespace left by the previous scope
+    def _getNamespace(self, scope: str) -> dict:
+        namespace = getLibNamespace()
+        for scope1, script in self._scope2script:
+            if scope1 in self._scope2namespace:
+                namespace = self._scope2namespace[scope1]
+            else:
+                namespace = self._execute(scope1, script, dict(namespace))
+                self._scope2namespace[scope1] = namespace
+            if scope1 == scope:
+                break
+        return namespace
+    
 
+    # union of the names assigned by the library and every script up to the scope
+    def _getAssignedNames(self, scope: str) -> set[str]:
+        varNames = set(getLibNames())
         for scope1, script in self._scope2script:
-            scripts.append(script)
+            if (assigned := self._scope2assignedNames.get(scope1)) is None:
+                try:
+                    assigned = collectAssignedNames(script)
+                except SyntaxError as e:
+                    logger.error("Error analyzing script for scope %s: %s" % (scope1, e))
+                    logger.error("when analyzing script: %s" % script)
+                    assigned = set()
+                self._scope2assignedNames[scope1] = assigned
+            varNames |= assigned
             if scope1 == scope:
-                break 
+                break
+        return varNames
 
-            
-        script = "\n".join(scripts)
 
-        try:
-            variables = self._execute(script)
-        except Exception as e:
-            
-            logger.error("Error generating local variable names for scope %s" % scope)
-            logger.error("when running script: %s" % script)
-            logger.error(e, exc_info=True)
-            sys.exit(1)
-            return set()
+    def getLocalVarNames(self, scope: str) -> set[str]:
+        if scope in self._scope2varNames:
+            return self._scope2varNames[scope]
         
-        varNames = set(variables.keys())
+        if self._varDiscovery == ExecutionManager.VAR_DISCOVERY_STATIC:
+            varNames = self._getAssignedNames(scope)
+        else:
+            varNames = set(self._getNamespace(scope).keys())
+            varNames.discard("__builtins__")
         self._scope2varNames[scope] = varNames
         return varNames
 
+
+    # static variable discovery never runs author scripts while converting
+    def executesScripts(self) -> bool:
+        return self._varDiscovery == ExecutionManager.VAR_DISCOVERY_EXEC
+
     
 
     # test run all scripts and embedded expression evaluation
     def verifyExecution(self) -> None:
-        with open("src/lon_capa_util.py", "r", encoding="utf-8") as f:
-            __libScript = f.read()        
-
-        exec(__libScript)
+        if not self.executesScripts():
+            logger.info("Skipping execution check, scripts are not run with static variable discovery")
+            return
+        namespace = dict(getLibNamespace())
 
         targetScopes = set(self._scope2reference.keys())
 
@@ -99,20 +179,48 @@ class ExecutionManager():
             if script is None or len(script.strip()) == 0:
                 logger.info("No script found for scope %s ..." % scope)
                 continue
-            exec(script)
+            exec(self._getCode(scope, script), namespace)
             for expr in self._scope2reference.get(scope, {}).values():
-                assert(eval(expr) is not None)
+                assert(eval(expr, namespace) is not None)
 
         
         assert(len(targetScopes) == 0)
 
 
-    def dumpScripts(self) -> dict:
-        return copy.deepcopy(self._scope2script)
+    # python source of a function running every scope script in order and returning
+    # the reference values of each scope, the same result genVariables in server.py computes
+    # by exec/eval. returns None if a script is not valid python
+    def dumpVariableGenerator(self) -> str|None:
+        body = ast.parse("_res = dict()").body
+        for scope, script in self._scope2script:
+            try:
+                body += ast.parse(script).body
+            except SyntaxError as e:
+                logger.error("Error compiling variable generator for scope %s: %s" % (scope, e))
+                return None
+            references = self._scope2reference.get(scope, {})
+            if len(references) > 0:
+                values = ", ".join("{}: {}".format(repr(name), expr) for name, expr in references.items())
+                body += ast.parse("_res[{}] = {{{}}}".format(repr(scope), values)).body
+        body += ast.parse("return _res").body
+
+        function = ast.FunctionDef(
+            name=ExecutionManager.VARIABLE_GENERATOR,
+            args=ast.arguments(posonlyargs=[], args=[], kwonlyargs=[], kw_defaults=[], defaults=[]),
+            body=body,
+            decorator_list=[],
+        )
+        return ast.unparse(ast.fix_missing_locations(ast.Module(body=[function], type_ignores=[]))) + "\n"
+
+
+    # scripts and expressions are immutable strings, copying the containers is enough
+    # to keep the dumped data.json content independent of later changes to the manager
+    def dumpScripts(self) -> list[tuple[str, str]]:
+        return list(self._scope2script)
     
 
-    def dumpReferences(self) -> dict:
-        return copy.deepcopy(self._scope2reference)
+    def dumpReferences(self) -> dict[str, dict[str, str]]:
+        return {scope: dict(references) for scope, references in self._scope2reference.items()}
 
         
 
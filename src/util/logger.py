@@ -1,8 +1,11 @@
 import logging
 import os
+import multiprocessing
 
 log_file_name = "lon2prairie.log"
-open(log_file_name, "w").close
+# spawned worker processes re-import this module, only the main process resets the log
+if multiprocessing.parent_process() is None:
+    open(log_file_name, "w").close
 
 
 logging.basicConfig(filename=log_file_name,
@@ -0,0 +1,84 @@
+from concurrent.futures import (Future, ThreadPoolExecutor)
+from typing import Callable
+
+
+# performs the filesystem operations producing generated files
+# with threads > 0 they run on a pool of background threads, so converting the next problem
+# overlaps with filesystem latency, and each operation is tagged with the question it belongs to
+# so that a failed write only fails that question. flush() is the barrier waiting for all of them
+# the operations of a question are batched and handed to the pool as one task once the question
+# is converted, they run in order and the first one failing skips the rest
+# with threads == 0 operations run immediately and raise like a plain write
+class OutputSink():
+
+    def __init__(self, threads: int = 0) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="output-sink") if threads > 0 else None
+        self._pending: list[tuple[str, Future]] = list()
+        # questions are converted one at a time by a process, only the current one has a batch
+        self._batchQuestion: str|None = None
+        self._batch: list[tuple[Callable, tuple]] = list()
+
+
+    def submit(self, question: str, fn: Callable, *args) -> None:
+        if self._executor is None:
+            fn(*args)
+            return
+        if question != self._batchQuestion:
+            self.endQuestion()
+            self._batchQuestion = question
+        self._batch.append((fn, args))
+
+
+    # hand the batched operations of the current question to the pool
+    def endQuestion(self) -> None:
+        if len(self._batch) > 0:
+            self._pending.append((self._batchQuestion, self._executor.submit(_runBatch, self._batch)))
+        self._batchQuestion = None
+        self._batch = list()
+
+
+    def writeText(self, question: str, path: str, content: str, encoding: str|None = None) -> None:
+        self.submit(question, _writeText, path, content, encoding)
+
+
+    # wait for every submitted operation, returns the first error of each question that had one
+    def flush(self) -> dict[str, Exception]:
+        self.endQuestion()
+        errors: dict[str, Exception] = dict()
+        for question, future in self._pending:
+            if (e := future.exception()) is not None and question not in errors:
+                errors[question] = e
+        self._pending.clear()
+        return errors
+
+
+    def close(self) -> None:
+        self.flush()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+
+def _runBatch(operations: list[tuple[Callable, tuple]]) -> None:
+    for fn, args in operations:
+        fn(*args)
+
+
+def _writeText(path: str, content: str, encoding: str|None) -> None:
+    with open(path, "w", encoding=encoding) as f:
+        f.write(content)
+
+
+
+_outputSink = OutputSink()
+
+
+# output sink of the process, writes are synchronous until configured otherwise
+def getOutputSink() -> OutputSink:
+    return _outputSink
+
+
+def configureOutputSink(threads: int) -> None:
+    global _outputSink
+    _outputSink.close()
+    _outputSink = OutputSink(threads)
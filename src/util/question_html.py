@@ -0,0 +1,238 @@
+import xml.etree.ElementTree as ET
+import re
+from html import escape, unescape
+
+
+# builds the tree of question.html directly from the problem data
+# mustache tags prairielearn renders at runtime are emitted as text, problem markup is parsed
+# into the tree as it is added so invalid markup is reported with the question it belongs to
+
+
+_entityRegex = re.compile("\\&#?\\w+\\;")
+
+
+# html entities are not known to the xml parser, turn them into characters unless they have to stay escaped
+def _normalizeEntity(matched: re.Match) -> str:
+    return escape(unescape(matched.group(0)))
+
+
+def normalizeMarkup(markup: str) -> str:
+    return _entityRegex.sub(_normalizeEntity, unescapeBraces(markup))
+
+
+def unescapeBraces(text: str) -> str:
+    if "\\{" in text or "\\}" in text:
+        text = text.replace("\\{", "{").replace("\\}", "}")
+    return text
+
+
+# attribute value of a problem data field, rendered the way mustache would
+def _attr(data: dict, key: str) -> str:
+    return unescapeBraces(str(data[key])) if key in data else ""
+
+
+
+# forwards the events of a parsed fragment into the question tree, without the wrapper element
+class _FragmentTarget():
+
+    def __init__(self, builder: ET.TreeBuilder) -> None:
+        self._builder = builder
+        self._depth = 0
+
+    def start(self, tag: str, attrs: dict) -> None:
+        if self._depth > 0:
+            self._builder.start(tag, attrs)
+        self._depth += 1
+
+    def end(self, tag: str) -> None:
+        self._depth -= 1
+        if self._depth > 0:
+            self._builder.end(tag)
+
+    def data(self, text: str) -> None:
+        self._builder.data(text)
+
+    def close(self) -> None:
+        pass
+
+
+
+class QuestionHtmlBuilder():
+
+    def __init__(self) -> None:
+        self._builder = ET.TreeBuilder()
+        self._open: list[str] = []
+        self._builder.start("root", {})
+
+
+    def text(self, text: str) -> None:
+        self._builder.data(text)
+
+
+    # parse a fragment of problem markup into the current element
+    def markup(self, markup: str|None, where: str) -> None:
+        if markup is None or len(markup) == 0:
+            return
+        parser = ET.XMLParser(target=_FragmentTarget(self._builder))
+        try:
+            parser.feed("<fragment>")
+            parser.feed(normalizeMarkup(markup))
+            parser.feed("</fragment>")
+            parser.close()
+        except ET.ParseError as e:
+            raise ET.ParseError("invalid markup in %s: %s\n%s" % (where, e, markup)) from e
+
+
+    def start(self, tag: str, attrs: dict[str, str]|None = None) -> None:
+        self._builder.start(tag, {} if attrs is None else attrs)
+        self._open.append(tag)
+
+
+    def end(self, tag: str) -> None:
+        if len(self._open) == 0 or self._open[-1] != tag:
+            raise Exception("question.html element %s closed while %s is open" % (tag, self._open[-1] if len(self._open) > 0 else "nothing"))
+        self._open.pop()
+        self._builder.end(tag)
+
+
+    def element(self, tag: str, attrs: dict[str, str]|None = None) -> None:
+        self.start(tag, attrs)
+        self.end(tag)
+
+
+    def close(self) -> ET.Element:
+        if len(self._open) > 0:
+            raise Exception("question.html elements left open: " + ", ".join(self._open))
+        self._builder.end("root")
+        return self._builder.close()
+
+
+
+def _buildStringInput(builder: QuestionHtmlBuilder, question: dict) -> None:
+    answerId = question["answerId"]
+    builder.text("\n{{#params.questions.%s}}\n" % answerId)
+    builder.element("pl-string-input", {
+        "answers-name": _attr(question, "answerId"),
+        "size": _attr(question, "inputSize"),
+        "placeholder": _attr(question, "placeholder"),
+        "correct-answer": "{{answerValue}}",
+    })
+    builder.text("\n{{/params.questions.%s}}\n" % answerId)
+
+
+def _buildMultipleChoice(builder: QuestionHtmlBuilder, question: dict) -> None:
+    answerId = question["answerId"]
+    builder.text("\n")
+    builder.start("pl-multiple-choice", {"answers-name": _attr(question, "answerId"), "fixed-order": "true"})
+    # lon-capa randomly presents a subset of all foils, thus we have to delay rendering until runtime
+    builder.text("\n{{#params.questions.%s.foils}}\n" % answerId)
+    builder.start("pl-answer", {"correct": "{{answerValue}}"})
+    builder.text("{{{foilPrompt}}}")
+    builder.end("pl-answer")
+    builder.text("\n{{/params.questions.%s.foils}}\n" % answerId)
+    builder.end("pl-multiple-choice")
+    builder.text("\n")
+
+
+def _buildDropdowns(builder: QuestionHtmlBuilder, question: dict) -> None:
+    answerId = question["answerId"]
+    builder.text("\n{{#params.questions.%s.foils}}\n" % answerId)
+    builder.start("div", {"style": "display:flex;"})
+    builder.start("pl-dropdown", {"answers-name": "{{answerId}}", "blank": _attr(question, "isBlank"), "sort": _attr(question, "sort")})
+    builder.text("\n{{#options}}\n")
+    builder.start("pl-answer", {"correct": "{{answerValue}}"})
+    builder.text("{{option}}")
+    builder.end("pl-answer")
+    builder.text("\n{{/options}}\n")
+    builder.end("pl-dropdown")
+    builder.start("p", {"style": "margin-left:10px;"})
+    builder.text("{{{foilPrompt}}}")
+    builder.end("p")
+    builder.end("div")
+    builder.text("\n{{/params.questions.%s.foils}}\n" % answerId)
+
+
+def _buildNumberInput(builder: QuestionHtmlBuilder, question: dict) -> None:
+    answerId = question["answerId"]
+    builder.text("\n{{#params.questions.%s}}\n" % answerId)
+    builder.element("pl-number-input", {
+        "answers-name": _attr(question, "answerId"),
+        "label": _attr(question, "label"),
+        "comparison": "relabs",
+        "rtol": "{{rtol}}",
+        "atol": "{{atol}}",
+        "placeholder": _attr(question, "placeholder"),
+        "correct-answer": "{{answerValue}}",
+        "show-help-text": "true",
+    })
+    builder.text("\n{{/params.questions.%s}}\n" % answerId)
+
+
+def _buildOrderBlocks(builder: QuestionHtmlBuilder, question: dict) -> None:
+    answerId = question["answerId"]
+    builder.text("\n")
+    builder.start("pl-order-blocks", {"answers-name": _attr(question, "answerId"), "grading-method": "ranking", "partial-credit": "none", "source-blocks-order": "ordered"})
+    builder.text("\n{{#params.questions.%s.foils}}\n" % answerId)
+    builder.start("pl-answer", {"ranking": "{{rank}}", "correct": "true"})
+    builder.text("{{{foilPrompt}}}")
+    builder.end("pl-answer")
+    builder.text("\n{{/params.questions.%s.foils}}\n" % answerId)
+    builder.end("pl-order-blocks")
+    builder.text("\n")
+
+
+_hint_file_tags = {
+    "isHTML": "pl-template",
+    "isImage": "pl-figure",
+    "isUnknownType": "pl-file-download",
+}
+
+
+def _buildHint(builder: QuestionHtmlBuilder, hint: dict, where: str) -> None:
+    builder.text("\n")
+    builder.markup(hint.get("precedingText"), "text preceding the hint of " + where)
+    builder.text("\n")
+    builder.start("pl-hidden-hints")
+    builder.start("pl-hint", {"show-after-submission": "1", "hint-name": "Hint"})
+    builder.markup(hint.get("prompt"), "hint of " + where)
+    builder.text(" ")
+    builder.element("br")
+    for file in hint.get("files", []):
+        for flag, tag in _hint_file_tags.items():
+            if file.get(flag):
+                builder.element(tag, {"file-name": _attr(file, "name"), "directory": "clientFilesQuestion"})
+                builder.element("br")
+    builder.end("pl-hint")
+    builder.end("pl-hidden-hints")
+    builder.text("\n")
+
+
+_question_builders = {
+    "isStringResponse": _buildStringInput,
+    "isReactionResponse": _buildStringInput,
+    "isRadioButtonResponse": _buildMultipleChoice,
+    "isOptionResponse": _buildDropdowns,
+    "isNumericalResponse": _buildNumberInput,
+    "isRankResponse": _buildOrderBlocks,
+}
+
+
+# raises ET.ParseError if the problem markup of a question is not well formed
+def buildQuestionHtml(problemData: dict) -> ET.Element:
+    builder = QuestionHtmlBuilder()
+    for i, question in enumerate(problemData.get("questions", [])):
+        where = "question %d" % (i + 1)
+        builder.text("\n")
+        builder.element("br")
+        builder.text("\n")
+        builder.markup(question.get("prompt"), "prompt of " + where)
+        builder.text("\n")
+        for flag, buildInput in _question_builders.items():
+            if question.get(flag):
+                buildInput(builder, question)
+        if question.get("hint"):
+            _buildHint(builder, question["hint"], where)
+    builder.text("\n")
+    builder.markup(problemData.get("tail"), "text after the last question")
+    builder.text("\n")
+    return builder.close()
@@ -0,0 +1,28 @@
+import importlib.util
+import os
+import sys
+
+
+# run the server.py of generated questions outside of prairielearn
+
+
+# import the server.py generated for a question, resolving a shared runtime under serverFilesCourse
+def loadQuestionServer(questionPath: str):
+    serverFilesCourse = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(questionPath))), "serverFilesCourse")
+    if serverFilesCourse not in sys.path:
+        sys.path.insert(0, serverFilesCourse)
+    spec = importlib.util.spec_from_file_location("server_" + os.path.basename(questionPath), questionPath + "/server.py")
+    server = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(server)
+    return server
+
+
+# a minimal stand-in for the data prairielearn hands to generate()
+def genPlData(questionPath: str) -> dict:
+    return {
+        "params": {},
+        "correct_answers": {},
+        "submitted_answers": {},
+        "format_errors": {},
+        "options": {"question_path": questionPath},
+    }
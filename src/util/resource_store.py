@@ -0,0 +1,113 @@
+import hashlib
+import os
+import shutil
+import uuid
+from util.logger import logger
+
+
+_hash_block_size = 1024 * 1024
+# directory of the store holding the list of stored files each question uses
+_refs_dir = "refs"
+
+
+
+# content addressed store of static resources shared by every question of the course
+# each distinct file is kept once under its sha256 and questions get hardlinks to it,
+# falling back to a copy where the filesystem does not support links
+# linked files share their content, edit them in the source course and reconvert instead of in place
+# the link count of a stored file does not tell whether a question uses it, copies do not count,
+# so every question records the files it got under refs/ and prune() keeps what live questions recorded
+class ResourceStore():
+
+    def __init__(self, storeDir: str) -> None:
+        self._storeDir = storeDir
+        self._refsDir = os.path.join(storeDir, _refs_dir)
+        # path -> (size, mtime in ns, sha256) of the files hashed by this process
+        self._hashes: dict[str, tuple[int, int, str]] = dict()
+
+
+    @staticmethod
+    def hashFile(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while len(block := f.read(_hash_block_size)) > 0:
+                digest.update(block)
+        return digest.hexdigest()
+
+
+    # sha256 of a file, only hashed again when its size or modification time changed
+    def _digest(self, path: str) -> str:
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = ResourceStore.hashFile(path)
+        self._hashes[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+
+    # returns the path of the stored copy of a file, adding it if its content is new
+    # workers may add the same content concurrently, the copy is moved in place atomically
+    def add(self, srcPath: str) -> str:
+        digest = self._digest(srcPath)
+        objectPath = os.path.join(self._storeDir, digest[:2], digest)
+        if not os.path.isfile(objectPath):
+            os.makedirs(os.path.dirname(objectPath), exist_ok=True)
+            tmpPath = objectPath + "." + uuid.uuid4().hex + ".tmp"
+            shutil.copyfile(srcPath, tmpPath)
+            os.replace(tmpPath, objectPath)
+        return objectPath
+
+
+    # forget the stored files a question used, before it is converted again
+    def resetReferences(self, question: str) -> None:
+        refsPath = os.path.join(self._refsDir, question)
+        if os.path.lexists(refsPath):
+            os.remove(refsPath)
+
+
+    # place the content of srcPath at dstPath for a question, as a link into the store when possible
+    def materialize(self, question: str, srcPath: str, dstPath: str) -> None:
+        objectPath = self.add(srcPath)
+        self._addReference(question, os.path.basename(objectPath))
+        if os.path.lexists(dstPath):
+            os.remove(dstPath)
+        try:
+            os.link(objectPath, dstPath)
+        except OSError as e:
+            logger.debug("Unable to link %s, copying it instead: %s" % (dstPath, e))
+            shutil.copyfile(objectPath, dstPath)
+
+
+    # a question is converted by a single process, the lines its writer threads append do not interleave
+    def _addReference(self, question: str, digest: str) -> None:
+        os.makedirs(self._refsDir, exist_ok=True)
+        with open(os.path.join(self._refsDir, question), "a") as f:
+            f.write(digest + "\n")
+
+
+    # remove the references of questions not in liveQuestions and the stored files
+    # no live question references, returns how many stored files were removed
+    def prune(self, liveQuestions: set[str]) -> int:
+        if not os.path.isdir(self._storeDir):
+            return 0
+        live = set()
+        if os.path.isdir(self._refsDir):
+            for question in os.listdir(self._refsDir):
+                refsPath = os.path.join(self._refsDir, question)
+                if question in liveQuestions:
+                    with open(refsPath, "r") as f:
+                        live.update(f.read().split())
+                else:
+                    os.remove(refsPath)
+        removed = 0
+        for dirPath, dirNames, fileNames in os.walk(self._storeDir):
+            if dirPath == self._storeDir and _refs_dir in dirNames:
+                dirNames.remove(_refs_dir)
+            for fileName in fileNames:
+                if fileName.endswith(".tmp") or fileName not in live:
+                    os.remove(os.path.join(dirPath, fileName))
+                    removed += 1
+            if dirPath != self._storeDir and len(os.listdir(dirPath)) == 0:
+                os.rmdir(dirPath)
+        return removed
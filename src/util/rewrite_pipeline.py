@@ -0,0 +1,40 @@
+import time
+import xml.etree.ElementTree as ET
+from typing import (Any, Callable)
+
+
+# in-place element rewrites registered by tag and applied in a single preorder traversal
+# each rewrite gets the element and the context of the problem being converted
+# rewrites are dispatched on the tag an element has when it is visited and run in registration order,
+# children are visited after their parent is rewritten, including the ones a rewrite added
+class RewritePipeline():
+
+    def __init__(self) -> None:
+        self._tag2rewrites: dict[str, list[tuple[str, Callable[[ET.Element, Any], None]]]] = dict()
+        self._names: list[str] = list()
+
+
+    def register(self, tag: str, rewrite: Callable[[ET.Element, Any], None], name: str|None = None) -> None:
+        name = rewrite.__name__ if name is None else name
+        if name in self._names:
+            raise Exception("Duplicate rewrite name " + name)
+        self._names.append(name)
+        self._tag2rewrites.setdefault(tag, []).append((name, rewrite))
+
+
+    # rewrite the tree under root iteratively, so deeply nested html cannot hit the recursion limit
+    # returns the time spent in each rewrite and in the traversal itself, in seconds
+    def apply(self, root: ET.Element, ctx: Any) -> dict[str, float]:
+        timings = {name: 0.0 for name in self._names}
+        start = time.perf_counter()
+        stack = [root]
+        while len(stack) > 0:
+            elem = stack.pop()
+            if (rewrites := self._tag2rewrites.get(elem.tag)) is not None:
+                for name, rewrite in rewrites:
+                    rewriteStart = time.perf_counter()
+                    rewrite(elem, ctx)
+                    timings[name] += time.perf_counter() - rewriteStart
+            stack.extend(reversed(elem))
+        timings["traversal"] = time.perf_counter() - start - sum(timings.values())
+        return timings
@@ -0,0 +1,101 @@
+import ast
+
+
+# collects names bound at module level by a python script, without running it
+# function, class, lambda and comprehension bodies have their own scope and are not descended into,
+# except for what is evaluated in the enclosing scope: default values, decorators, the first iterable
+# of a comprehension, and assignment expressions inside comprehensions, which bind in the enclosing scope
+class _AssignedNameCollector(ast.NodeVisitor):
+
+    def __init__(self) -> None:
+        self.names: set[str] = set()
+
+    def visit_Name(self, node: ast.Name) -> None:
+        if isinstance(node.ctx, ast.Store):
+            self.names.add(node.id)
+
+    def _visitAll(self, nodes: list) -> None:
+        for node in nodes:
+            if node is not None:
+                self.visit(node)
+
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> None:
+        self.names.add(node.name)
+        self._visitAll(node.decorator_list + node.args.defaults + node.args.kw_defaults)
+
+    def visit_AsyncFunctionDef(self, node: ast.AsyncFunctionDef) -> None:
+        self.visit_FunctionDef(node)
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
+        self.names.add(node.name)
+        self._visitAll(node.decorator_list + node.bases + [keyword.value for keyword in node.keywords])
+
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            self.names.add(alias.asname if alias.asname is not None else alias.name.split(".")[0])
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        for alias in node.names:
+            if alias.name != "*":
+                self.names.add(alias.asname if alias.asname is not None else alias.name)
+
+    def visit_ExceptHandler(self, node: ast.ExceptHandler) -> None:
+        if node.name is not None:
+            self.names.add(node.name)
+        self.generic_visit(node)
+
+    def visit_MatchAs(self, node: ast.MatchAs) -> None:
+        if node.name is not None:
+            self.names.add(node.name)
+        self.generic_visit(node)
+
+    def visit_MatchStar(self, node: ast.MatchStar) -> None:
+        if node.name is not None:
+            self.names.add(node.name)
+
+    def visit_MatchMapping(self, node: ast.MatchMapping) -> None:
+        if node.rest is not None:
+            self.names.add(node.rest)
+        self.generic_visit(node)
+
+    def visit_Lambda(self, node: ast.Lambda) -> None:
+        self._visitAll(node.args.defaults + node.args.kw_defaults)
+
+    def _visitComprehension(self, node: ast.AST) -> None:
+        self.visit(node.generators[0].iter)
+        self.names |= _collectComprehensionBindings(node)
+
+    def visit_ListComp(self, node: ast.ListComp) -> None:
+        self._visitComprehension(node)
+
+    def visit_SetComp(self, node: ast.SetComp) -> None:
+        self._visitComprehension(node)
+
+    def visit_DictComp(self, node: ast.DictComp) -> None:
+        self._visitComprehension(node)
+
+    def visit_GeneratorExp(self, node: ast.GeneratorExp) -> None:
+        self._visitComprehension(node)
+
+
+
+# targets of the assignment expressions in a comprehension, nested ones included,
+# lambdas inside it bind their own
+def _collectComprehensionBindings(node: ast.AST) -> set[str]:
+    names = set()
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop()
+        if isinstance(node, ast.NamedExpr) and isinstance(node.target, ast.Name):
+            names.add(node.target.id)
+        if not isinstance(node, (ast.Lambda, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            stack.extend(ast.iter_child_nodes(node))
+    return names
+
+
+# names a script may bind when executed, regardless of which branches are taken
+# raises SyntaxError if the script is not valid python
+def collectAssignedNames(pyScript: str) -> set[str]:
+    collector = _AssignedNameCollector()
+    collector.visit(ast.parse(pyScript))
+    return collector.names
@@ -0,0 +1,73 @@
+import hashlib
+from util.execution_manager import ExecutionManager
+from util.logger import logger
+
+
+# a question whose variants need more attempts than this on average is reported as slow to generate
+SLOW_EXPECTED_ATTEMPTS = 10
+
+# namespaces of the executed server.py runtimes by the hash of their code
+_runtimeNamespaces: dict[str, dict] = dict()
+
+
+# the generated server.py runtime, executed once per process and version of its code
+def getRuntimeNamespace(runtimeCode: str) -> dict:
+    key = hashlib.sha256(runtimeCode.encode("utf-8")).hexdigest()
+    if (namespace := _runtimeNamespaces.get(key)) is None:
+        namespace = dict()
+        exec(compile(runtimeCode, "<server.py>", "exec"), namespace)
+        _runtimeNamespaces[key] = namespace
+    return namespace
+
+
+# draw variables the way generate() does and measure how often each question
+# rejects them, e.g. a numerical answer outside its sigRange or a radio button group
+# without a correct choice. problemData is the content of data.json
+def profileVariants(runtimeCode: str, generatorCode: str, problemData: dict, samples: int) -> dict:
+    namespace = dict(getRuntimeNamespace(runtimeCode))
+    exec(compile(generatorCode, "<variables.py>", "exec"), namespace)
+    drawVariables = namespace[ExecutionManager.VARIABLE_GENERATOR]
+    genVariant = namespace["genVariant"]
+
+    questions = problemData.get("questions", {})
+    rejectedBy = {questionId: 0 for questionId in questions}
+    accepted = 0
+    drawn = 0
+    error = None
+
+    for _ in range(samples):
+        try:
+            variables = drawVariables()
+            # evaluate each question on its own so every rejection rate is unconditional
+            isAccepted = True
+            for questionId, question in questions.items():
+                if genVariant({"questions": {questionId: question}}, variables) is None:
+                    rejectedBy[questionId] += 1
+                    isAccepted = False
+        except Exception as e:
+            error = "%s: %s" % (type(e).__name__, e)
+            break
+        drawn += 1
+        accepted += 1 if isAccepted else 0
+
+    return {
+        "requestedSamples": samples,
+        "samples": drawn,
+        "accepted": accepted,
+        "acceptanceRate": accepted / drawn if drawn > 0 else None,
+        "expectedAttempts": drawn / accepted if accepted > 0 else None,
+        "rejectionRates": {questionId: count / drawn for questionId, count in rejectedBy.items()} if drawn > 0 else {},
+        "error": error,
+    }
+
+
+# log a warning for profiles whose variants would make generate() slow under load
+def checkVariantProfile(problemName: str, profile: dict) -> None:
+    if profile["error"] is not None:
+        logger.warning("variant profiling for problem %s stopped after %d samples: %s" % (problemName, profile["samples"], profile["error"]))
+    elif profile["samples"] == 0:
+        return
+    elif profile["accepted"] == 0:
+        logger.warning("no variant accepted in %d samples for problem %s, rejection rates %s" % (profile["samples"], problemName, profile["rejectionRates"]))
+    elif profile["expectedAttempts"] > SLOW_EXPECTED_ATTEMPTS:
+        logger.warning("problem %s needs %.1f attempts per variant on average, rejection rates %s" % (problemName, profile["expectedAttempts"], profile["rejectionRates"]))
@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+
+# the converter runs from the repo root with src on the python path, see src/main.py
+_repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_repo_root, "src"))
+
+
+@pytest.fixture(autouse=True)
+def repoRoot(monkeypatch) -> str:
+    monkeypatch.chdir(_repo_root)
+    return _repo_root
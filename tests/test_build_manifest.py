@@ -0,0 +1,118 @@
+import shutil
+import pytest
+import main
+import util.build_manifest
+import util.context
+from util.build_manifest import BuildManifest
+from util.output_sink import (getOutputSink, configureOutputSink)
+
+
+@pytest.fixture
+def writeThreads():
+    configureOutputSink(2)
+    yield
+    configureOutputSink(0)
+
+
+def makeGroup(tmp_path, names: list[str]) -> list[str]:
+    paths = []
+    for name in names:
+        (tmp_path / "src" / name).mkdir(parents=True)
+        (tmp_path / "src" / name / "q.problem").write_text("<problem>%s</problem>" % name)
+        paths.append(str(tmp_path / "src" / name))
+    return paths
+
+
+def test_unchanged_group_is_skipped_and_changed_one_rebuilt(tmp_path):
+    paths = makeGroup(tmp_path, ["a"])
+    (tmp_path / "out" / "a").mkdir(parents=True)
+    manifest = BuildManifest({"allResources": False}, str(tmp_path / "manifest.json"))
+    manifest.record("a", BuildManifest.hashSources(paths), (paths[0], "a"))
+    manifest.save()
+
+    manifest = BuildManifest({"allResources": False}, str(tmp_path / "manifest.json"))
+    assert manifest.isUpToDate("a", BuildManifest.hashSources(paths), str(tmp_path / "out"))
+    (tmp_path / "src" / "a" / "q.problem").write_text("<problem>changed</problem>")
+    assert not manifest.isUpToDate("a", BuildManifest.hashSources(paths), str(tmp_path / "out"))
+
+
+def test_options_invalidate_every_group(tmp_path):
+    paths = makeGroup(tmp_path, ["a"])
+    (tmp_path / "out" / "a").mkdir(parents=True)
+    manifest = BuildManifest({"allResources": False}, str(tmp_path / "manifest.json"))
+    manifest.record("a", BuildManifest.hashSources(paths), (paths[0], "a"))
+    manifest.save()
+    assert BuildManifest({"allResources": True}, str(tmp_path / "manifest.json")).isEmpty()
+
+
+def test_only_converter_code_invalidates_every_group(tmp_path, monkeypatch):
+    toolchainDir = tmp_path / "toolchain"
+    shutil.copytree("src", toolchainDir, ignore=shutil.ignore_patterns("__pycache__"))
+    monkeypatch.setattr(util.build_manifest, "_toolchain_dir", str(toolchainDir))
+    toolchainHash = BuildManifest()._toolchainHash
+
+    with open(toolchainDir / "benchmark.py", "a") as f:
+        f.write("\n# changed\n")
+    (toolchainDir / "pregenerate.py").unlink()
+    assert BuildManifest()._toolchainHash == toolchainHash
+
+    with open(toolchainDir / "util" / "context.py", "a") as f:
+        f.write("\n# changed\n")
+    assert BuildManifest()._toolchainHash != toolchainHash
+
+
+# converts the first dir of the group to out/<dir>, its files cannot be written if it is listed in failing
+def fakeConvert(tmp_path, failing: set[str]):
+    def convertQuestionGroup(paths, options=None):
+        if len(paths) == 0:
+            return None
+        problemId = paths[0].split("/")[-1]
+        outputDir = tmp_path / ("missing" if problemId in failing else "out") / problemId
+        if problemId not in failing:
+            outputDir.mkdir(parents=True, exist_ok=True)
+        getOutputSink().writeText(problemId, str(outputDir / "info.json"), problemId)
+        return (paths[0], problemId)
+    return convertQuestionGroup
+
+
+# convert the pending groups and record them, like a build does
+def build(tmp_path, groups: dict[str, list[str]]) -> list[str]:
+    manifest = BuildManifest({}, str(tmp_path / "manifest.json"))
+    sources = {key: BuildManifest.hashSources(paths) for key, paths in groups.items()}
+    pending = [key for key in groups if not manifest.isUpToDate(key, sources[key], str(tmp_path / "out"))]
+    results = [main.convertQuestionGroup(groups[key]) for key in pending]
+    results, writeFailed = main.flushQuestionOutputs([groups[key] for key in pending], results)
+    main.recordConvertedGroups(manifest, pending, sources, results, writeFailed)
+    manifest.save()
+    return pending
+
+
+def test_failed_write_falls_back_to_the_next_dir(tmp_path, monkeypatch, writeThreads):
+    paths = makeGroup(tmp_path, ["a", "b"])
+    monkeypatch.setattr(main, "convertQuestionGroup", fakeConvert(tmp_path, {"a"}))
+    results, writeFailed = main.flushQuestionOutputs([paths], [main.convertQuestionGroup(paths)])
+    assert results == [(paths[1], "b")]
+    assert writeFailed == [False]
+    assert (tmp_path / "out" / "b" / "info.json").is_file()
+
+
+def test_failed_write_is_retried_by_the_next_build(tmp_path, monkeypatch, writeThreads):
+    groups = {"a": makeGroup(tmp_path, ["a"])}
+    monkeypatch.setattr(main, "convertQuestionGroup", fakeConvert(tmp_path, {"a"}))
+    assert build(tmp_path, groups) == ["a"]
+    assert not (tmp_path / "out" / "a").exists()
+
+    # the sources did not change, the write is retried and succeeds
+    monkeypatch.setattr(main, "convertQuestionGroup", fakeConvert(tmp_path, set()))
+    assert build(tmp_path, groups) == ["a"]
+    assert (tmp_path / "out" / "a" / "info.json").is_file()
+    assert build(tmp_path, groups) == []
+
+
+def test_shared_runtime_is_removed_when_the_option_is_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(util.context, "_server_files_course_dir", str(tmp_path / "serverFilesCourse"))
+    main.updateSharedRuntime(True)
+    assert (tmp_path / "serverFilesCourse" / "lon_capa_runtime" / "__init__.py").is_file()
+    main.updateSharedRuntime(False)
+    assert not (tmp_path / "serverFilesCourse" / "lon_capa_runtime").exists()
+    main.updateSharedRuntime(False)
@@ -0,0 +1,91 @@
+import pytest
+from typing import (List, Tuple)
+from perl_translator import lexer
+from perl_translator.lexer import lex
+from benchmark import genPerlScript
+
+
+# reference implementation trying every rule against the remaining script at each cursor,
+# quadratic in script length. the lexer lex() replaced
+def lexNaive(perlScript: str) -> List[Tuple[int, str]]:
+    tokens = []
+    cursor = 0
+
+    while cursor < len(perlScript):
+
+        #parse string separately
+        if perlScript[cursor] in ["'", '"']:
+            string, length = lexer.parseString(perlScript[cursor:])
+            cursor += length
+            tokens.append((lexer.STRING, string))
+            continue
+
+
+
+        lexemeType = None
+        value = None
+        for type, regex in lexer.DEF.items():
+            
+            if (matched := regex.match(perlScript[cursor:])) == None:
+                continue
+            v = matched.group(0)
+            if len(v) == 0:
+                raise Exception(lexer.symbolName[type], "matches empty string")
+
+            #try match the longest string
+            if value is None or len(v) > len(value):
+                value = v 
+                lexemeType = type
+
+               
+        if lexemeType is None or value is None:
+            raise Exception("Lexer failed. No rules matched at: " + perlScript[cursor:])
+        
+        cursor += len(value)
+
+        
+        if lexemeType != lexer.BLANK:
+            tokens.append((lexemeType, value))
+            
+        
+    return tokens
+
+
+def test_lex_assignment():
+    assert lex('$x = &random(1, 10, 0.5);') == [
+        (lexer.ID, "$x"), (lexer.OP_ASSIGN, "="), (lexer.ID, "&random"), (lexer.LP, "("),
+        (lexer.INT_DECIMAL, "1"), (lexer.COMMA, ","), (lexer.INT_DECIMAL, "10"), (lexer.COMMA, ","),
+        (lexer.FLOAT_FIXED, "0.5"), (lexer.RP, ")"), (lexer.SEMICOL, ";"),
+    ]
+
+
+def test_lex_longest_match_wins():
+    assert lex("$y ** 2 .. 3 <= 1.5e-3") == [
+        (lexer.ID, "$y"), (lexer.OP_EXP, "**"), (lexer.INT_DECIMAL, "2"), (lexer.DOUBLE_DOT, ".."),
+        (lexer.INT_DECIMAL, "3"), (lexer.LE, "<="), (lexer.FLOAT_SCIENTIFIC, "1.5e-3"),
+    ]
+
+
+def test_lex_strings_and_comments():
+    assert lex('$s = "a \\"b\\" c" . \'c\'; # note\n') == [
+        (lexer.ID, "$s"), (lexer.OP_ASSIGN, "="), (lexer.STRING, 'a \\"b\\" c'), (lexer.OP_CONCAT, "."),
+        (lexer.STRING, "c"), (lexer.SEMICOL, ";"), (lexer.COMMENT_SINGLE_LINE, "# note\n"),
+    ]
+
+
+# like the perl rule it was written from, a block comment is greedy and runs to the last =cut
+def test_lex_block_comment_runs_to_last_cut():
+    assert lex("=pod\nx\n=cut\n$b = 2;\n=cut\n$c;") == [
+        (lexer.COMMENT_BLOCK, "=pod\nx\n=cut\n$b = 2;\n=cut"), (lexer.ID, "$c"), (lexer.SEMICOL, ";"),
+    ]
+
+
+def test_lex_rejects_unknown_characters():
+    with pytest.raises(Exception):
+        lex("$a = `ls`;")
+
+
+@pytest.mark.parametrize("sizeBytes", [200, 5_000, 20_000])
+def test_lex_matches_reference(sizeBytes):
+    script = genPerlScript(sizeBytes)
+    assert lex(script) == lexNaive(script)
@@ -0,0 +1,40 @@
+import os
+import pytest
+from util.output_sink import OutputSink
+from util.resource_store import ResourceStore
+
+
+def test_writes_of_a_question_run_as_one_batch(tmp_path):
+    sink = OutputSink(threads=2)
+    for question in ["q1", "q2"]:
+        for fileName in ["info.json", "question.html", "server.py"]:
+            sink.writeText(question, str(tmp_path / (question + "-" + fileName)), question)
+        sink.endQuestion()
+    assert [question for question, _ in sink._pending] == ["q1", "q2"]
+    assert sink.flush() == {}
+    assert len(os.listdir(tmp_path)) == 6
+    sink.close()
+
+
+def test_flush_reports_the_failed_question(tmp_path):
+    sink = OutputSink(threads=2)
+    sink.writeText("q1", str(tmp_path / "missing" / "info.json"), "")
+    sink.writeText("q1", str(tmp_path / "q1-server.py"), "")
+    sink.writeText("q2", str(tmp_path / "q2-server.py"), "")
+    errors = sink.flush()
+    assert list(errors.keys()) == ["q1"]
+    assert isinstance(errors["q1"], FileNotFoundError)
+    # the batch stops at its first failure
+    assert os.listdir(tmp_path) == ["q2-server.py"]
+    sink.close()
+
+
+def test_failed_resource_fails_the_question(tmp_path):
+    store = ResourceStore(str(tmp_path / "store"))
+    sink = OutputSink(threads=1)
+    sink.submit("q1", store.materialize, "q1", str(tmp_path / "missing.png"), str(tmp_path / "q1.png"))
+    assert isinstance(sink.flush().get("q1"), FileNotFoundError)
+    sink.close()
+
+    with pytest.raises(FileNotFoundError):
+        OutputSink().submit("q1", store.materialize, "q1", str(tmp_path / "missing.png"), str(tmp_path / "q1.png"))
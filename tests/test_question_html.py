@@ -0,0 +1,111 @@
+import random
+import re
+import xml.etree.ElementTree as ET
+from html import (escape, unescape)
+import pytest
+from util.context import Context
+from util.question_html import buildQuestionHtml
+from main import (rewritePipeline, walkXmlTree)
+from benchmark import genProblemData
+
+
+_problem_dir = "tests/fixtures/quiz"
+
+# the mustache template question.html was rendered from before buildQuestionHtml(),
+# escaped braces are left for prairielearn to render at runtime
+_question_template_path = "tests/fixtures/question.mustache"
+
+_response_flags = ["isStringResponse", "isReactionResponse", "isRadioButtonResponse", "isOptionResponse",
+                   "isNumericalResponse", "isRankResponse"]
+
+
+# reference implementation rendering the template over the problem data and parsing the rendered markup back
+def renderQuestionHtmlNaive(problemData: dict) -> ET.Element:
+    pystache = pytest.importorskip("pystache")
+    with open(_question_template_path, "r") as f:
+        rendered = pystache.render(f.read(), problemData)
+    rendered = rendered.replace("\\{", "{")
+    rendered = rendered.replace("\\}", "}")
+    rendered = re.sub("\\&#?\\w+\\;", lambda x: escape(unescape(x.group(0))), rendered)
+    return ET.fromstring(rendered)
+
+
+# the template rendering indents differently, compare the trees with whitespace collapsed
+def normalizeWhitespace(elem: ET.Element) -> bytes:
+    def collapse(text: str|None) -> str|None:
+        return None if text is None or len(text.split()) == 0 else " ".join(text.split())
+    for node in elem.iter():
+        node.text = collapse(node.text)
+        node.tail = collapse(node.tail)
+    return ET.tostring(elem)
+
+
+def assertMatchesReference(problemData: dict) -> None:
+    assert normalizeWhitespace(buildQuestionHtml(problemData)) == normalizeWhitespace(renderQuestionHtmlNaive(problemData))
+
+
+def genRandomProblemData(rng: random.Random) -> dict:
+    questions = []
+    for i in range(rng.randint(0, 4)):
+        question = {}
+        if rng.random() < 0.9:
+            question["prompt"] = rng.choice(["", "a &nbsp; b", "<b>x</b> \\{y\\}", "&amp; &lt;", "1 &deg; <i>C</i>"])
+        flag = rng.choice(_response_flags + [None])
+        if flag is not None:
+            question[flag] = True
+            question["answerId"] = "ans-%d" % i
+            for key in ["inputSize", "placeholder", "label", "isBlank", "sort"]:
+                if rng.random() < 0.7:
+                    question[key] = rng.choice([None, 10, "p&q", '"x"', "false", True, "\\{a\\}", 0])
+        if rng.random() < 0.4:
+            question["hint"] = {
+                "precedingText": rng.choice(["", "pre &nbsp;", "<p>t</p>"]),
+                "prompt": rng.choice(["h", "<i>h</i>"]),
+                "files": [{"name": "f%d.x" % j, rng.choice(["isHTML", "isImage", "isUnknownType"]): True} for j in range(rng.randint(0, 2))],
+            }
+        questions.append(question)
+    return {"questions": questions, "tail": rng.choice(["", "t &copy;", "<p>end</p>"])}
+
+
+def test_problem_matches_reference():
+    ctx = Context(_problem_dir)
+    rewritePipeline.apply(ctx.xmlRoot, ctx)
+    walkXmlTree(ctx.xmlRoot, ctx)
+    assertMatchesReference(ctx._problemData)
+
+
+def test_generated_problem_matches_reference():
+    assertMatchesReference(genProblemData(12))
+
+
+def test_random_problems_match_reference():
+    rng = random.Random(0)
+    for _ in range(500):
+        assertMatchesReference(genRandomProblemData(rng))
+
+
+def test_runtime_tags_are_left_to_prairielearn():
+    html = ET.tostring(buildQuestionHtml(genProblemData(6)), encoding="unicode")
+    assert "{{#params.questions.ans-0}}" in html
+    assert 'correct-answer="{{answerValue}}"' in html
+    assert "{{#params.questions.ans-2.foils}}" in html
+
+
+def test_malformed_markup():
+    data = {"questions": [{"prompt": "<p>unclosed", "answerId": "ans-0", "isStringResponse": True}], "tail": ""}
+    with pytest.raises(ET.ParseError, match="ans-0|prompt"):
+        buildQuestionHtml(data)
+
+
+def test_malformed_markup_skips_question_html(monkeypatch):
+    written = []
+    monkeypatch.setattr(Context, "_writeFile", lambda self, fileName, *args, **kwargs: written.append(fileName))
+    ctx = Context.__new__(Context)
+    ctx.problemName = "malformed"
+    ctx._prettyHtml = False
+    ctx._problemData = {"questions": [{"prompt": "<p>unclosed"}], "tail": ""}
+    ctx._genProblemHtml()
+    assert written == []
+    ctx._problemData = {"questions": [{"prompt": "<p>closed</p>"}], "tail": ""}
+    ctx._genProblemHtml()
+    assert written == ["question.html"]
@@ -0,0 +1,110 @@
+import re
+import pytest
+from parsers.common_parser import reduceEmbeddedExprs
+from util.execution_manager import ExecutionManager
+from util.logger import logger
+from benchmark import BenchContext, genPromptHtml
+
+
+_script = "scalar_mass=1\nscalar_i=0\nvector_values=[1,2,3]\n"
+_scope = ExecutionManager.SCOPE_DEFAULT
+
+
+# reference implementation scanning the text one character at a time,
+# the reducer reduceEmbeddedExprs replaced
+def reduceEmbeddedExprsNaive(text: str, ctx, scope: str, inText: bool = False) -> str:
+
+    text = text.replace("&amp;", "&")
+
+    identifierRegex = "\\$[a-zA-Z_][a-zA-Z0-9_]*"
+    arrayIndexingRegex = "^{}\\[({}|\\d+)\\]".format(identifierRegex, identifierRegex)
+    result = []
+    
+    visibleVars = ctx.getVisibleVariablesNames(scope)
+    def isInScope(varName):
+        return varName in visibleVars
+
+    i = 0
+    while i < len(text):
+        chr = text[i]
+        if not chr == "$":
+            result.append(chr)
+            i += 1
+        else:
+            if (matched := re.match(arrayIndexingRegex, text[i:])):
+                matched = matched.group(0)
+                arrayName, idxExpr = matched.split("[")
+                arrayName = "vector_" + arrayName[1:]
+                
+                if not isInScope(arrayName):
+                    logger.warning("array ID %s not found when reducing array indexing expression under scope %s" % (arrayName, scope))
+                    result.append(matched)
+                    i += len(matched)
+                    continue
+                
+                
+                if idxExpr[0].isdigit():
+                    idxSym = str(int(idxExpr[:-1])) 
+                else:
+                    idxSym = "scalar_" + idxExpr[1:-1]
+                    if not isInScope(idxSym):
+                        logger.warning("index ID %s not found when reducing array indexing expression under scope %s" % (arrayName, scope))
+                        result.append(matched)
+                        i += len(matched)
+                        continue
+                
+                expr = "{}[{}]".format(arrayName, idxSym)
+                exprName = ctx.addReference(scope, expr)
+                if inText:
+                    form = "{{{params.generatedVars." + scope + "." +exprName+"}}}"
+                else:
+                    form = "{{"+exprName+"}}"
+                result.append(form)
+                i += len(matched)
+            elif (matched := re.match(identifierRegex, text[i:])):
+                matched = matched.group(0)
+                varName = "scalar_" + matched[1:]
+                if not isInScope(varName):
+                    logger.warning("scalar ID %s not found when reducing expression under scope %s" % (varName, scope))
+                    result.append(matched)
+                    i += len(matched)
+                    continue
+                exprName = ctx.addReference(scope, varName)
+                if inText:
+                    form = "{{{params.generatedVars." + scope + "." + exprName+"}}}"
+                else:
+                    form = "{{"+exprName+"}}"
+                result.append(form)
+                i += len(matched)
+            else:
+                result.append(chr)
+                i += 1
+             
+    return  "".join(result)
+
+
+def test_reduce_scalars_and_array_indexing():
+    ctx = BenchContext(_script)
+    reduced = reduceEmbeddedExprs("m=$mass v=$values[$i] w=$values[02] again $mass", ctx, _scope)
+    assert reduced == "m={{value-0}} v={{value-1}} w={{value-2}} again {{value-0}}"
+    assert ctx._executionManager.dumpReferences() == {_scope: {
+        "value-0": "scalar_mass", "value-1": "vector_values[scalar_i]", "value-2": "vector_values[2]"}}
+
+
+def test_reduce_in_text_renders_generated_vars():
+    assert reduceEmbeddedExprs("<p>$mass &amp; g</p>", BenchContext(_script), _scope, inText=True) == \
+        "<p>{{{params.generatedVars.%s.value-0}}} & g</p>" % _scope
+
+
+def test_reduce_keeps_unknown_names():
+    assert reduceEmbeddedExprs("$unknown $values[$j] $$5", BenchContext(_script), _scope) == "$unknown $values[$j] $$5"
+
+
+@pytest.mark.parametrize("sizeBytes", [500, 20_000])
+@pytest.mark.parametrize("inText", [False, True])
+def test_reduce_matches_reference(sizeBytes, inText):
+    script = "scalar_mass=1\nscalar_volume=2\nscalar_digits=3\nscalar_i=0\nvector_values=[1,2,3]\n"
+    text = genPromptHtml(sizeBytes)
+    ctx, referenceCtx = BenchContext(script), BenchContext(script)
+    assert reduceEmbeddedExprs(text, ctx, _scope, inText) == reduceEmbeddedExprsNaive(text, referenceCtx, _scope, inText)
+    assert ctx._executionManager.dumpReferences() == referenceCtx._executionManager.dumpReferences()
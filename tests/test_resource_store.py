@@ -0,0 +1,65 @@
+import os
+from util.resource_store import ResourceStore
+
+
+def writeFile(path, content: bytes) -> str:
+    with open(path, "wb") as f:
+        f.write(content)
+    return str(path)
+
+
+def storedFiles(storeDir) -> list[str]:
+    return sorted(fileName for dirPath, _, fileNames in os.walk(storeDir) if os.path.basename(dirPath) != "refs"
+                  for fileName in fileNames)
+
+
+def test_materialize_links_identical_content(tmp_path):
+    store = ResourceStore(str(tmp_path / "store"))
+    first, second = writeFile(tmp_path / "a.png", b"same"), writeFile(tmp_path / "b.png", b"same")
+    store.materialize("q1", first, str(tmp_path / "q1.png"))
+    store.materialize("q2", second, str(tmp_path / "q2.png"))
+    assert storedFiles(tmp_path / "store") == [ResourceStore.hashFile(first)]
+    assert os.stat(tmp_path / "q1.png").st_ino == os.stat(tmp_path / "q2.png").st_ino
+
+
+def test_hash_is_reused_until_the_file_changes(tmp_path, monkeypatch):
+    store = ResourceStore(str(tmp_path / "store"))
+    src = writeFile(tmp_path / "a.png", b"first")
+    hashed = []
+    hashFile = ResourceStore.hashFile
+    monkeypatch.setattr(ResourceStore, "hashFile", staticmethod(lambda path: hashed.append(path) or hashFile(path)))
+    store.materialize("q1", src, str(tmp_path / "q1.png"))
+    store.materialize("q2", src, str(tmp_path / "q2.png"))
+    assert hashed == [src]
+
+    writeFile(tmp_path / "a.png", b"second, longer")
+    store.materialize("q1", src, str(tmp_path / "q1.png"))
+    assert hashed == [src, src]
+    assert open(tmp_path / "q1.png", "rb").read() == b"second, longer"
+
+
+def test_prune_keeps_files_of_live_questions(tmp_path, monkeypatch):
+    store = ResourceStore(str(tmp_path / "store"))
+    kept, dropped = writeFile(tmp_path / "kept.png", b"kept"), writeFile(tmp_path / "dropped.png", b"dropped")
+
+    # copies made where the filesystem does not support links are still live
+    def failLink(src, dst):
+        raise OSError("links not supported")
+    monkeypatch.setattr(os, "link", failLink)
+    store.materialize("q1", kept, str(tmp_path / "q1.png"))
+    store.materialize("q2", dropped, str(tmp_path / "q2.png"))
+    assert store.prune({"q1", "q2"}) == 0
+
+    assert store.prune({"q1"}) == 1
+    assert storedFiles(tmp_path / "store") == [ResourceStore.hashFile(kept)]
+    assert os.listdir(tmp_path / "store" / "refs") == ["q1"]
+
+
+def test_reconverted_question_drops_its_old_files(tmp_path):
+    store = ResourceStore(str(tmp_path / "store"))
+    old, new = writeFile(tmp_path / "old.png", b"old"), writeFile(tmp_path / "new.png", b"new")
+    store.materialize("q1", old, str(tmp_path / "q1-old.png"))
+    store.resetReferences("q1")
+    store.materialize("q1", new, str(tmp_path / "q1-new.png"))
+    assert store.prune({"q1"}) == 1
+    assert storedFiles(tmp_path / "store") == [ResourceStore.hashFile(new)]
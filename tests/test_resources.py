@@ -0,0 +1,36 @@
+import os
+import xml.etree.ElementTree as ET
+from util.context import Context
+from parsers.common_parser import parseScript
+from util.execution_manager import ExecutionManager
+from main import (rewritePipeline, walkXmlTree)
+
+
+def walkProblem(problemDir: str) -> Context:
+    ctx = Context(problemDir)
+    rewritePipeline.apply(ctx.xmlRoot, ctx)
+    walkXmlTree(ctx.xmlRoot, ctx)
+    return ctx
+
+
+def referencedResources(ctx: Context, problemDir: str) -> list[str]:
+    srcPath = problemDir + "/res"
+    return sorted(ctx._findReferencedResources(srcPath, sorted(os.listdir(srcPath))))
+
+
+def test_static_and_hint_links():
+    # pic.png is the src of an img, hint.html a link of the hint group, unused.txt is not referenced
+    ctx = walkProblem("tests/fixtures/quiz")
+    assert referencedResources(ctx, "tests/fixtures/quiz") == ["hint.html", "pic.png"]
+
+
+def test_interpolated_link_copies_all_files():
+    ctx = walkProblem("tests/fixtures/dynamic_figure")
+    assert referencedResources(ctx, "tests/fixtures/dynamic_figure") == ["1.png", "2.png"]
+
+
+def test_image_built_in_script_copies_all_files():
+    ctx = walkProblem("tests/fixtures/quiz")
+    script = ET.fromstring('<script type="loncapa/perl">$html = \'&lt;img src="/res/foo/$fig" /&gt;\';</script>')
+    parseScript(script, ctx, ExecutionManager.SCOPE_DEFAULT)
+    assert referencedResources(ctx, "tests/fixtures/quiz") == ["hint.html", "pic.png", "unused.txt"]
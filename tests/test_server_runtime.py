@@ -0,0 +1,192 @@
+import json
+import os
+import pytest
+from util.context import Context
+from util.variant_profiler import getRuntimeNamespace
+
+
+@pytest.fixture
+def runtime() -> dict:
+    return getRuntimeNamespace(Context._genRuntimeCode())
+
+
+# a radio button question accepted only by variables whose value-0 is "true"
+_problemData = {"questions": {"ans-1": {
+    "isRadioButtonResponse": True,
+    "scope": "s",
+    "maxDisplayed": 1,
+    "foils": [{"foilPrompt": "A", "answerValue": ["", "value-0", ""]}],
+}}}
+
+
+# draws variables rejected the given number of times before an accepted one
+def genDraws(rejected: int):
+    draws = []
+    def drawVariables() -> dict:
+        draws.append(None)
+        return {"s": {"value-0": "true" if len(draws) > rejected else "false"}}
+    return drawVariables, draws
+
+
+def test_sample_variant_stops_at_first_acceptance(runtime):
+    drawVariables, draws = genDraws(2)
+    variant, variables = runtime["sampleVariant"](_problemData, drawVariables, "q-first")
+    assert len(draws) == 3
+    assert variables == {"s": {"value-0": "true"}}
+    assert variant == {"ans-1": {"foils": [{"answerValue": "true", "foilPrompt": "A"}]}}
+
+
+def test_sample_variant_decides_on_its_own_attempts(runtime):
+    drawVariables, draws = genDraws(0)
+    runtime["sampleVariant"](_problemData, drawVariables, "q-history")
+    drawVariables, _ = genDraws(10_000)
+    with pytest.raises(runtime["VariantGenerationError"], match="after 300 attempts, 1 accepted by the process in 301 attempts, "
+                                                               "rejections by question: ans-1: 300"):
+        runtime["sampleVariant"](_problemData, drawVariables, "q-history", maxAttempts=300)
+    # a long history of rejections does not cut a later call short
+    drawVariables, draws = genDraws(500)
+    runtime["sampleVariant"](_problemData, drawVariables, "q-history")
+    assert len(draws) == 501
+    assert runtime["variantStats"]["q-history"]["attempts"] == 802
+
+
+def test_sample_variant_aborts_when_never_accepted(runtime):
+    drawVariables, draws = genDraws(10_000)
+    with pytest.raises(runtime["VariantGenerationError"], match="after 100 attempts, 0 accepted"):
+        runtime["sampleVariant"](_problemData, drawVariables, "q-never")
+    assert len(draws) == runtime["VARIANT_ABORT_REJECTIONS"]
+
+
+def test_sample_variant_in_batches(runtime):
+    drawVariables, draws = genDraws(2)
+    variant, variables = runtime["sampleVariant"](_problemData, drawVariables, "q-batch", batchSize=4)
+    assert len(draws) == 4
+    assert variables == {"s": {"value-0": "true"}}
+    assert runtime["variantStats"]["q-batch"]["accepted"] == 2
+
+
+def test_generate_takes_the_sampling_budget_from_data_json(runtime, tmp_path):
+    data = dict(_problemData, sampling={"maxAttempts": 7})
+    (tmp_path / "data.json").write_text(json.dumps(data))
+    (tmp_path / "variables.py").write_text('def genQuestionVariables():\n    return {"s": {"value-0": "false"}}\n')
+    plData = {"params": {}, "options": {"question_path": str(tmp_path)}}
+    with pytest.raises(runtime["VariantGenerationError"], match="after 7 attempts"):
+        runtime["generate"](plData)
+
+
+def writeQuestionFile(path, content: str, mtime: int) -> None:
+    with open(path, "w") as f:
+        f.write(content)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_variable_generator_follows_reconversion(runtime, tmp_path):
+    questionPath = str(tmp_path)
+    writeQuestionFile(tmp_path / "data.json", '{"questions": {}}', 1_000)
+    writeQuestionFile(tmp_path / "variables.py", "def genQuestionVariables():\n    return 1\n", 1_000)
+    _, problemHash = runtime["loadProblemFile"](questionPath)
+    assert runtime["loadVariableGenerator"](questionPath, problemHash)() == 1
+
+    # a reconverted question gets a new variables.py along with its new data.json
+    writeQuestionFile(tmp_path / "data.json", '{"questions": {}, "script": []}', 2_000)
+    writeQuestionFile(tmp_path / "variables.py", "def genQuestionVariables():\n    return 2\n", 2_000)
+    _, newHash = runtime["loadProblemFile"](questionPath)
+    assert newHash != problemHash
+    assert runtime["loadVariableGenerator"](questionPath, newHash)() == 2
+
+    os.remove(tmp_path / "variables.py")
+    assert runtime["loadVariableGenerator"](questionPath, newHash) is None
+
+
+def test_problem_versions_are_bounded(runtime, tmp_path):
+    questionPath = str(tmp_path)
+    hashes = []
+    for version in range(10):
+        writeQuestionFile(tmp_path / "data.json", '{"questions": {}, "version": %d}' % version, 1_000 + version)
+        hashes.append(runtime["loadProblemFile"](questionPath)[1])
+    versions = runtime["_problemVersions"][questionPath]
+    assert list(versions.keys()) == hashes[-runtime["_max_problem_versions"]:]
+
+    plData = {"options": {"question_path": questionPath}, "params": {"problemHash": hashes[-2]}}
+    assert runtime["loadProblemData"](plData)["version"] == 8
+    # variants of a version the process no longer has are parsed with the current one
+    plData["params"]["problemHash"] = hashes[0]
+    assert runtime["loadProblemData"](plData)["version"] == 9
+
+
+def test_known_problem_version_is_not_decoded_again(runtime, tmp_path, monkeypatch):
+    questionPath = str(tmp_path)
+    writeQuestionFile(tmp_path / "data.json", '{"questions": {}}', 1_000)
+    problemData, _ = runtime["loadProblemFile"](questionPath)
+    decoded = []
+    monkeypatch.setattr(runtime["json"], "loads", lambda content: decoded.append(content))
+    os.utime(tmp_path / "data.json", ns=(2_000, 2_000))
+    assert runtime["loadProblemFile"](questionPath)[0] is problemData
+    assert decoded == []
+
+
+def test_string_variant_holds_only_its_answer(runtime):
+    question = {"isStringResponse": True, "scope": "s", "answerValue": ["", "value-0", " mol"], "inputSize": 10}
+    variant = runtime["genStringResponseVariant"](question, {"value-0": 2})
+    assert variant == {"answerValue": "2 mol"}
+    assert question["answerValue"] == ["", "value-0", " mol"]
+
+
+# a string response question whose match type changes between two conversions
+def writeStringQuestion(tmp_path, matchType: str, mtime: int) -> None:
+    data = {"questions": {"ans-1": {"isStringResponse": True, "scope": "s", "answerValue": ["", "value-0", " Mol"],
+                                    "matchType": matchType}},
+            "renderedExprs": {"s": ["value-1"]}}
+    writeQuestionFile(tmp_path / "data.json", json.dumps(data), mtime)
+    writeQuestionFile(tmp_path / "variables.py",
+                      'def genQuestionVariables():\n    return {"s": {"value-0": 2, "value-1": "x", "value-2": 3}}\n', mtime)
+
+
+def submit(plData: dict, answer: str) -> dict:
+    return dict(plData, submitted_answers={"ans-1": answer}, format_errors={})
+
+
+def test_variant_is_parsed_with_the_problem_it_was_generated_from(runtime, tmp_path):
+    writeStringQuestion(tmp_path, "ci", 1_000)
+    plData = {"params": {}, "options": {"question_path": str(tmp_path)}}
+    runtime["generate"](plData)
+    assert plData["params"]["questions"] == {"ans-1": {"answerValue": "2 Mol"}}
+    assert plData["params"]["generatedVars"] == {"s": {"value-1": "x"}}
+
+    # the question is re-converted with a case-sensitive match after the variant was stored
+    writeStringQuestion(tmp_path, "cs", 2_000)
+    parsed = submit(plData, "2 mol")
+    runtime["parse"](parsed)
+    assert parsed["submitted_answers"]["ans-1"] == "2 Mol"
+
+    # a variant generated after the re-conversion is parsed with the new version
+    newPlData = {"params": {}, "options": {"question_path": str(tmp_path)}}
+    runtime["generate"](newPlData)
+    assert newPlData["params"]["problemHash"] != plData["params"]["problemHash"]
+    parsed = submit(newPlData, "2 mol")
+    runtime["parse"](parsed)
+    assert parsed["submitted_answers"]["ans-1"] == "2 mol"
+
+
+def test_unknown_problem_hash_is_parsed_with_the_current_problem(runtime, tmp_path, monkeypatch):
+    writeStringQuestion(tmp_path, "ci", 1_000)
+    plData = {"params": {}, "options": {"question_path": str(tmp_path)}}
+    runtime["generate"](plData)
+    writeStringQuestion(tmp_path, "cs", 2_000)
+
+    # a fresh worker never read the version the variant was generated from
+    monkeypatch.setitem(runtime, "_problemDataCache", dict())
+    monkeypatch.setitem(runtime, "_problemVersions", dict())
+    parsed = submit(plData, "2 mol")
+    runtime["parse"](parsed)
+    assert plData["params"]["problemHash"] not in runtime["_problemVersions"][str(tmp_path)]
+    assert parsed["submitted_answers"]["ans-1"] == "2 mol"
+
+
+def test_compact_variables_keeps_rendered_expressions(runtime):
+    variables = {"s": {"value-0": 1, "value-1": 2}, "t": {"value-2": 3}}
+    assert runtime["compactVariables"](variables, {"s": ["value-1", "value-5"], "u": ["value-3"]}) == \
+        {"s": {"value-1": 2}, "u": {}}
+    assert runtime["compactVariables"](variables, {}) == {}
+    # data.json converted before renderedExprs was recorded keeps every variable
+    assert runtime["compactVariables"](variables, None) is variables
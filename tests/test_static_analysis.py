@@ -0,0 +1,49 @@
+import pytest
+from util.static_analysis import collectAssignedNames
+from util.execution_manager import ExecutionManager
+
+
+# names a script leaves in its namespace when executed
+def executedNames(script: str) -> set[str]:
+    namespace = dict()
+    exec(script, namespace)
+    return set(namespace.keys()) - {"__builtins__"}
+
+
+# the collector may over-approximate, e.g. with branches not taken, but never miss a name
+@pytest.mark.parametrize("script", [
+    "a = 1\nb, (c, *d) = 2, (3, 4, 5)\ne = 0\ne += 1\n",
+    "for i in range(3):\n    j = i\nelse:\n    k = 0\n",
+    "import os.path\nfrom math import sqrt as root\n",
+    "def f(x=(default := 1)):\n    inner = x\nclass C:\n    member = 1\n",
+    "try:\n    raise ValueError()\nexcept ValueError as err:\n    caught = True\n",
+    "squares = [y * y for y in range(3)]\nevens = {z for z in range(4) if z % 2 == 0}\n",
+    "last = [(w := v) for v in range(3)]\n",
+    "pairs = {p: q for p, q in [(1, 2)] if (seen := p)}\n",
+    "nested = [[(deep := x) for x in range(y)] for y in range(3)]\n",
+    "f = lambda x: (inner := x)\nf(1)\n",
+    "match (1, 2, {'k': 3}):\n    case (m, *rest, {'k': n, **others}):\n        matched = True\n",
+    "if (found := 3) > 2:\n    ok = found\n",
+])
+def test_collect_assigned_names_covers_execution(script):
+    assert executedNames(script) <= collectAssignedNames(script)
+
+
+@pytest.mark.parametrize("script, names", [
+    ("last = [(w := v) for v in range(3)]\n", {"last", "w"}),
+    ("nested = [[(deep := x) for x in range(y)] for y in range(3)]\n", {"nested", "deep"}),
+    ("f = lambda x: (inner := x)\n", {"f"}),
+    ("g = (lambda: [(own := 1) for _ in 'a'])\n", {"g"}),
+    ("if False:\n    never = 1\n", {"never"}),
+])
+def test_collect_assigned_names(script, names):
+    assert collectAssignedNames(script) == names
+
+
+def test_static_discovery_runs_no_script():
+    manager = ExecutionManager(ExecutionManager.VAR_DISCOVERY_STATIC)
+    manager.setScript(ExecutionManager.SCOPE_DEFAULT, "raise RuntimeError('executed')\nx = 1\n")
+    manager.addReference(ExecutionManager.SCOPE_DEFAULT, "x")
+    assert not manager.executesScripts()
+    assert "x" in manager.getLocalVarNames(ExecutionManager.SCOPE_DEFAULT)
+    manager.verifyExecution()
@@ -0,0 +1,49 @@
+import json
+import os
+import main
+import util.context
+from util.context import Context
+from util.variant_profiler import getRuntimeNamespace
+
+
+# a question accepting every other draw of its variables
+_generator_code = """
+_draws = []
+def genQuestionVariables():
+    _draws.append(None)
+    return {"s": {"value-0": "true" if len(_draws) % 2 == 0 else "false"}}
+"""
+
+_problem_data = {"questions": {"ans-1": {
+    "isRadioButtonResponse": True,
+    "scope": "s",
+    "maxDisplayed": 1,
+    "foils": [{"foilPrompt": "A", "answerValue": ["", "value-0", ""]}],
+}}}
+
+
+def test_runtime_namespace_is_cached_by_code():
+    runtimeCode = Context._genRuntimeCode()
+    assert getRuntimeNamespace(runtimeCode) is getRuntimeNamespace(runtimeCode)
+    changed = getRuntimeNamespace(runtimeCode + "\nRUNTIME_VERSION = 2\n")
+    assert changed is not getRuntimeNamespace(runtimeCode)
+    assert changed["RUNTIME_VERSION"] == 2
+    assert "RUNTIME_VERSION" not in getRuntimeNamespace(runtimeCode)
+
+
+def test_profiles_are_kept_out_of_the_questions(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "_output_dir", str(tmp_path / "questions"))
+    monkeypatch.setattr(main, "_variant_profile_report", str(tmp_path / "variant_profile.json"))
+    monkeypatch.setattr(main, "VARIANT_PROFILE_DIR", str(tmp_path / "variant_profiles"))
+    monkeypatch.setattr(util.context, "VARIANT_PROFILE_DIR", str(tmp_path / "variant_profiles"))
+    questionDir = tmp_path / "questions" / "1-q"
+    questionDir.mkdir(parents=True)
+    (questionDir / "variables.py").write_text(_generator_code)
+    (questionDir / "data.json").write_text(json.dumps(_problem_data))
+
+    main.profileConvertedQuestions(["1-q"], 20)
+    main.writeVariantProfileReport(["1-q"])
+    assert sorted(os.listdir(questionDir)) == ["data.json", "variables.py"]
+    assert os.listdir(tmp_path / "variant_profiles") == ["1-q.json"]
+    report = json.loads((tmp_path / "variant_profile.json").read_text())
+    assert report["1-q"]["acceptanceRate"] == 0.5
@@ -0,0 +1,117 @@
+import copy
+import xml.etree.ElementTree as ET
+import pytest
+from util.context import Context
+from util.execution_manager import ExecutionManager
+from parsers.common_parser import (reduceEmbeddedExprs, parseScript, parseProblemHint)
+from main import (rewritePipeline, walkXmlTree, problemTargets, parseProblem)
+from benchmark import (BenchContext, genInlineProblem)
+
+
+_problem_dir = "tests/fixtures/quiz"
+
+
+# reference implementation concatenating the markup and mixing strings with elements on the stack,
+# the walker walkXmlTree replaced
+def walkXmlTreeNaive(root: ET.Element, ctx) -> None:
+
+    notHTML = ["script", "part", "problem", "startouttext", "endouttext", "starttext", "endtext", "allow", "parameter", "root"]
+    precedingMarkup = "" if root.text is None else root.text
+
+    stack = [root]
+    scopes = [ExecutionManager.SCOPE_DEFAULT]
+    ctx.setScript(ExecutionManager.SCOPE_DEFAULT, "")
+
+    while len(stack) > 0:
+        elem = stack.pop()
+
+        if type(elem) == str:
+            if elem == "pop_scope":
+                precedingMarkup = reduceEmbeddedExprs(precedingMarkup, ctx, scopes[-1], inText=True)
+                scopes.pop()
+            else:
+                precedingMarkup += elem 
+            continue
+
+        tag = elem.tag 
+
+        if tag == "script":
+            parseScript(elem, ctx, scopes[-1])
+        
+        elif tag == "hintgroup":
+            parseProblemHint(elem, ctx, scopes[-1], precedingMarkup)
+            precedingMarkup = "" if elem.tail is None else elem.tail
+
+        elif tag in problemTargets:
+            parseProblem(elem, ctx, precedingMarkup, scopes[-1])
+            precedingMarkup = "" if elem.tail is None else elem.tail
+
+        else:
+
+            # try explore children
+            children = [child for child in elem]
+            
+            if tag == "part":
+                scopeId = "scope_" + elem.get("id")
+                if scopeId in scopes:
+                    raise Exception("Duplicate part id in problem")
+                scopes.append(scopeId)
+                ctx.setScript(scopeId, "")
+                children.append("pop_scope")
+
+            children.reverse()
+
+            tail = ""
+            # some elems are not html
+            if not tag in notHTML:
+                attrs = " ".join('{}="{}"'.format(k, v) for k, v in elem.attrib.items())
+                precedingMarkup += "<{} {}>".format(tag, attrs)
+                tail = "</{}>".format(tag)
+
+            if elem.text is not None:
+                precedingMarkup += elem.text
+                
+            if elem.tail is not None: 
+                tail = tail + elem.tail 
+            
+            children = [tail] + children # hacky, adds in succeeding text
+            stack += children
+    
+    if precedingMarkup is not None:
+        ctx._problemData["tail"] =  reduceEmbeddedExprs(precedingMarkup, ctx, scopes[-1], inText=True)
+
+
+def walkProblem(walk) -> Context:
+    ctx = Context(_problem_dir)
+    rewritePipeline.apply(ctx.xmlRoot, ctx)
+    walk(ctx.xmlRoot, ctx)
+    return ctx
+
+
+def test_walk_problem():
+    ctx = walkProblem(walkXmlTree)
+    questions = ctx._problemData["questions"]
+    assert [question["answerId"] for question in questions] == ["ans-%d" % i for i in range(1, 7)]
+    scope = ExecutionManager.SCOPE_DEFAULT
+    assert "What is {{{params.generatedVars.%s.value-0}}} times 2?" % scope in questions[0]["prompt"]
+    assert "<b >bold</b>" in questions[0]["prompt"]
+    assert "$missing" in questions[0]["prompt"]
+    assert "{{{params.generatedVars.scope_p1." in questions[1]["prompt"]
+    # a hint group belongs to the question before it
+    assert questions[4]["hint"]["files"] == [{"name": "hint.html", "isHTML": True}]
+    assert ctx._problemData["tail"].strip() == ""
+
+
+def test_walk_problem_matches_reference():
+    ctx, referenceCtx = walkProblem(walkXmlTree), walkProblem(walkXmlTreeNaive)
+    assert ctx._problemData == referenceCtx._problemData
+    assert ctx._executionManager.dumpReferences() == referenceCtx._executionManager.dumpReferences()
+
+
+@pytest.mark.parametrize("elements", [10, 1_000])
+def test_walk_inline_markup_matches_reference(elements):
+    root = genInlineProblem(elements)
+    ctx, referenceCtx = BenchContext(""), BenchContext("")
+    walkXmlTree(copy.deepcopy(root), ctx)
+    walkXmlTreeNaive(copy.deepcopy(root), referenceCtx)
+    assert ctx._problemData["tail"] == referenceCtx._problemData["tail"]
@@ -0,0 +1,133 @@
+import random
+import re
+import xml.etree.ElementTree as ET
+import pytest
+from util import exceptions
+from util.context import (Context, XmlSanitizer, cleanXml)
+
+
+_script = '<script type="loncapa/perl">'
+
+
+# reference implementation escaping in several char-by-char passes,
+# the sanitizer cleanXml replaced
+def cleanXmlNaive(xml: str) -> str:
+
+    # escape all dangling '&'s
+    escaped = []
+    for i in range(len(xml)):
+        if xml[i] == "&" and xml[i:i+5] != "&amp;":
+            escaped.append("&amp;")
+        else:
+            escaped.append(xml[i])
+    xml = "".join(escaped)
+
+    #escape <, > within script
+    start = False
+    escaped = []
+    i = 0
+    while i<len(xml):
+        if i+28 < len(xml) and xml[i:i+28] == '<script type="loncapa/perl">':
+            start = True
+            escaped.append('<script type="loncapa/perl">')
+            i += 28
+        elif i+9 < len(xml) and xml[i:i+9] == "</script>":
+            start = False
+            escaped.append("</script>")
+            i += 9
+        elif start:
+            if xml[i] == "<":
+                escaped.append("&lt;")
+            elif xml[i] == ">":
+                escaped.append("&gt;")
+            else:
+                escaped.append(xml[i])
+            i += 1
+        else:
+            escaped.append(xml[i])
+            i += 1
+    xml = "".join(escaped)
+
+    xml = re.sub("<\\s", "&lt; ", xml)
+    xml = re.sub("\\s>", " &gt;", xml)
+    return xml
+
+
+@pytest.mark.parametrize("xml, cleaned", [
+    ("a & b &amp; c", "a &amp; b &amp; c"),
+    ("<p>1 < 2 and 3 > 2</p>", "<p>1 &lt; 2 and 3 &gt; 2</p>"),
+    ("<p>x <\ty</p>", "<p>x &lt; y</p>"),
+    (_script + "$a = 1 < 2 && 3 > 2;</script>rest", _script + "$a = 1 &lt; 2 &amp;&amp; 3 &gt; 2;</script>rest"),
+    # script tags at the very end are not recognized, like the original passes did
+    ("<b>x</b>" + _script, "<b>x</b>" + _script),
+])
+def test_clean_xml(xml, cleaned):
+    assert cleanXml(xml) == cleaned
+
+
+def test_clean_xml_parses():
+    root = ET.fromstring(cleanXml("<root><p>a & b < c</p>" + _script + "if ($a<$b) {}</script>\n</root>"))
+    assert root.find("p").text == "a & b < c"
+    assert root.find("script").text == "if ($a<$b) {}"
+
+
+# fragments that exercise every escape, script markers and their boundaries
+_fragments = [_script, "</script>", "<", ">", "&", "&amp;", "&lt;", "amp;", " ", "\n", "\t", "a", "<b>", "</b>",
+              "< ", " >", "$x", '"', "<root>", "</root>"]
+
+
+def test_clean_xml_matches_reference():
+    rand = random.Random(0)
+    for _ in range(20_000):
+        xml = "".join(rand.choice(_fragments) for _ in range(rand.randint(0, 20)))
+        assert cleanXml(xml) == cleanXmlNaive(xml), xml
+
+
+def sanitizeInChunks(xml: str, rand: random.Random, maxChunk: int) -> str:
+    sanitizer = XmlSanitizer()
+    escaped = []
+    cursor = 0
+    while cursor < len(xml):
+        size = rand.randint(1, maxChunk)
+        escaped.append(sanitizer.feed(xml[cursor:cursor + size]))
+        cursor += size
+    escaped.append(sanitizer.close())
+    return "".join(escaped)
+
+
+def test_chunked_sanitizer_matches_clean_xml():
+    rand = random.Random(0)
+    for _ in range(5_000):
+        xml = "".join(rand.choice(_fragments) for _ in range(rand.randint(0, 40)))
+        assert sanitizeInChunks(xml, rand, 12) == cleanXml(xml), xml
+
+
+def assertSameTree(left: ET.Element, right: ET.Element) -> None:
+    assert ET.tostring(left) == ET.tostring(right)
+
+
+@pytest.mark.parametrize("chunkSize", [1, 7, 1024])
+def test_streaming_loader_matches_whole_file(chunkSize):
+    path = "tests/fixtures/quiz/quiz.problem"
+    ctx = Context.__new__(Context)
+    assertSameTree(Context._parseXmlStreaming(path, chunkSize), ctx._parseXml(path))
+
+
+def test_streaming_loader_large_problem(tmp_path):
+    path = tmp_path / "large.problem"
+    image = "A" * 300_000
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<problem>" + _script + "$a = 1 < 2 && 3 > 2;</script>\n")
+        for i in range(200):
+            f.write("<startouttext/><p>row %d: a & b < c</p><img src=\"data:image/png;base64,%s\"/><endouttext/>\n" % (i, image if i == 100 else ""))
+        f.write("</problem>")
+    ctx = Context.__new__(Context)
+    assertSameTree(Context._parseXmlStreaming(str(path), 64 * 1024), ctx._parseXml(str(path)))
+
+
+def test_streaming_loader_rejects_html(tmp_path):
+    path = tmp_path / "page.problem"
+    path.write_text("<problem>" + "x" * 100 + "<html></html></problem>")
+    with pytest.raises(Exception) as raised:
+        Context._parseXmlStreaming(str(path), 16)
+    assert raised.value is exceptions.HTML_NOT_SUPPORTED